@@ -1,22 +1,64 @@
-import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
-from gtts import gTTS
+from gtts import gTTS, gTTSError
 
+from TTS.engine_wrapper import split_text
+from TTS.provider import TTSProvider
 from utils import settings
+from utils.voice import backoff_delay
 
+# gTTS reads English with the accent of the Google Translate domain it is sent to
+voices = ["com", "co.uk", "com.au", "ca", "co.in", "ie", "co.za"]
+
+
+class GTTS(TTSProvider):
+    max_chars = 5000
+    max_concurrency = 4  # clips synthesized at the same time
+    voices = voices
+
+    # Google takes 100 characters per request, the requests of a clip are sent at the same time
+    # by a pool shared by every instance and thread
+    part_concurrency = 8
+    _executor = ThreadPoolExecutor(max_workers=part_concurrency)
 
-class GTTS:
     def __init__(self):
-        self.max_chars = 5000
-        self.voices = []
-
-    def run(self, text, filepath):
-        tts = gTTS(
-            text=text,
-            lang=settings.config["reddit"]["thread"]["post_lang"] or "en",
-            slow=False,
+        self.max_retries = 3
+
+    def run(self, text, filepath, random_voice: bool = False):
+        lang = settings.config["reddit"]["thread"]["post_lang"] or "en"
+        tld = self.randomvoice() if random_voice and lang.startswith("en") else "com"
+        parts = list(
+            self._executor.map(
+                lambda part: self.fetch_part(part, lang, tld),
+                split_text(text, gTTS.GOOGLE_TTS_MAX_CHARS),
+            )
         )
-        tts.save(filepath)
 
-    def randomvoice(self):
-        return random.choice(self.voices)
+        # the parts are joined in memory and written at once, in their original order
+        audio = BytesIO()
+        for part in parts:
+            audio.write(part)
+        self.save([audio.getbuffer()], filepath)
+
+    def fetch_part(self, text: str, lang: str, tld: str) -> bytes:
+        """Fetches the audio of one part, short enough for a single request
+
+        Raises:
+            gTTSError: When the part could not be fetched after max_retries attempts
+        """
+        for attempt in range(self.max_retries):
+            audio = BytesIO()
+            try:
+                gTTS(text=text, lang=lang, tld=tld, slow=False).write_to_fp(audio)
+            except gTTSError as e:
+                response = getattr(e, "rsp", None)
+                # connection errors, rate limits and server errors are worth another try
+                retryable = response is None or response.status_code == 429
+                retryable = retryable or response.status_code >= 500
+                if not retryable or attempt + 1 == self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            return audio.getvalue()
@@ -6,7 +6,15 @@ from typing import Final, Optional
 
 import requests
 
+from TTS.provider import TTSProvider
 from utils import settings
+from utils.voice import (
+    CircuitBreaker,
+    CircuitOpenError,
+    backoff_delay,
+    pooled_session,
+    retry_after,
+)
 
 __all__ = ["TikTok", "TikTokTTSException"]
 
@@ -76,9 +84,15 @@ vocals: Final[tuple] = (
 )
 
 
-class TikTok:
+class TikTok(TTSProvider):
     """TikTok Text-to-Speech Wrapper"""
 
+    max_chars = 200
+    max_concurrency = 4  # clips synthesized at the same time
+
+    # shared by all instances, so every run in the process stops calling a dead endpoint
+    _breaker = CircuitBreaker("The TikTok TTS API", failure_threshold=5, reset_timeout=60)
+
     def __init__(self):
         headers = {
             "User-Agent": "com.zhiliaoapp.musically/2022600030 (Linux; U; Android 7.1.2; es_ES; SM-G988N; "
@@ -87,11 +101,15 @@ class TikTok:
         }
 
         self.URI_BASE = "https://api16-normal-c-useast1a.tiktokv.com/media/api/text/speech/invoke/"
-        self.max_chars = 200
 
-        self._session = requests.Session()
+        # one kept-alive connection per concurrent request
+        self._session = pooled_session(
+            int(settings.get_setting("settings", "tts", "max_concurrency")) or self.max_concurrency
+        )
         # set the headers to the session, so we don't have to do it for every request
         self._session.headers = headers
+        self.timeout = (5, 30)  # seconds to connect, seconds to read
+        self.max_retries = 4
 
     def run(self, text: str, filepath: str, random_voice: bool = False):
         if random_voice:
@@ -133,14 +151,42 @@ class TikTok:
         if voice is not None:
             params["text_speaker"] = voice
 
-        # send request
+        # while the API is down fail at once, so the next provider in the chain is tried
         try:
-            response = self._session.post(self.URI_BASE, params=params)
-        except ConnectionError:
-            time.sleep(random.randrange(1, 7))
-            response = self._session.post(self.URI_BASE, params=params)
+            trial = self._breaker.before_call(wait=sum(self.timeout))
+        except CircuitOpenError as e:
+            raise TikTokTTSException(0, str(e))
 
-        return response.json()
+        try:
+            data = self._post(params)
+        except BaseException:
+            # whatever the call ends in, a trial call has to release the breaker
+            self._breaker.record_failure(trial)
+            raise
+        self._breaker.record_success(trial)
+        return data
+
+    def _post(self, params: dict) -> dict:
+        """Sends the request, retrying request errors, 429/5xx and non JSON error pages"""
+        for attempt in range(self.max_retries + 1):
+            wait = 0.0
+            try:
+                response = self._session.post(self.URI_BASE, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code == 429 or response.status_code >= 500:
+                    error = f"HTTP {response.status_code}"
+                    wait = retry_after(response)
+                else:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        error = f"HTTP {response.status_code} with a non JSON body"
+            if attempt == self.max_retries:
+                # only a call that used up its retries counts towards opening the circuit
+                raise TikTokTTSException(0, f"The request failed {attempt + 1} times: {error}")
+            time.sleep(max(wait, backoff_delay(attempt)))
 
     @staticmethod
     def random_voice() -> str:
@@ -162,4 +208,4 @@ class TikTokTTSException(Exception):
         if self._code == 4:
             return f"Code: {self._code}, reason: the speaker doesn't exist, message: {self._message}"
 
-        return f"Code: {self._message}, reason: unknown, message: {self._message}"
+        return f"Code: {self._code}, reason: unknown, message: {self._message}"
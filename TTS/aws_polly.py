@@ -1,9 +1,12 @@
-import random
-import sys
+import threading
+import time
+from urllib.parse import urlparse
 
 from boto3 import Session
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
 
+from TTS.provider import TTSProvider
 from utils import settings
 
 voices = [
@@ -24,54 +27,128 @@ voices = [
     "Raveena",
 ]
 
+SYNC_MAX_CHARS = 3000  # the most characters synthesize_speech takes
+TASK_MAX_CHARS = 100000  # the most characters a speech synthesis task takes
+TASK_POLL_INTERVAL = 2  # seconds between status checks of a speech synthesis task
+TASK_TIMEOUT = 600  # seconds a speech synthesis task may take
+
+# botocore retries throttling and 5xx errors itself, with backoff, up to max_attempts
+CLIENT_CONFIG = Config(
+    retries={"max_attempts": 5, "mode": "standard"},
+    connect_timeout=5,
+    read_timeout=60,
+    max_pool_connections=16,
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _client(service: str, endpoint_url: str):
+    """Returns the client of a service, created once per process and shared by every thread
+
+    Creating a session loads the botocore models and resolves the credentials, which is too slow
+    to do for every clip. Clients are thread safe, sessions aren't, hence the lock.
+    """
+    key = (service, endpoint_url)
+    with _clients_lock:
+        if key not in _clients:
+            try:
+                session = Session(profile_name="polly")
+            except ProfileNotFound:
+                session = Session()  # environment variables, the default profile or a role
+            if session.get_credentials() is None:
+                raise AWSPollyException(
+                    "You need to install the AWS CLI and configure your profile\n"
+                    "Linux: https://docs.aws.amazon.com/polly/latest/dg/setup-aws-cli.html\n"
+                    "Windows: https://docs.aws.amazon.com/polly/latest/dg/install-voice-plugin2.html"
+                )
+            _clients[key] = session.client(
+                service, endpoint_url=endpoint_url or None, config=CLIENT_CONFIG
+            )
+        return _clients[key]
+
+
+class AWSPolly(TTSProvider):
+    max_chars = SYNC_MAX_CHARS
+    max_concurrency = 4  # clips synthesized at the same time
+    voices = voices
 
-class AWSPolly:
     def __init__(self):
-        self.max_chars = 3000
-        self.voices = voices
+        self.bucket = settings.get_setting("settings", "tts", "aws_polly_s3_bucket")
+        self.endpoint_url = settings.get_setting("settings", "tts", "aws_polly_endpoint_url")
+        # with a bucket, long texts go to a single speech synthesis task instead of being split
+        self.max_chars = TASK_MAX_CHARS if self.bucket else SYNC_MAX_CHARS
 
     def run(self, text, filepath, random_voice: bool = False):
-        try:
-            session = Session(profile_name="polly")
-            polly = session.client("polly")
-            if random_voice:
-                voice = self.randomvoice()
-            else:
-                if not settings.config["settings"]["tts"]["aws_polly_voice"]:
-                    raise ValueError(
-                        f"Please set the TOML variable AWS_VOICE to a valid voice. options are: {voices}"
-                    )
-                voice = str(settings.config["settings"]["tts"]["aws_polly_voice"]).capitalize()
-            try:
-                # Request speech synthesis
-                response = polly.synthesize_speech(
-                    Text=text, OutputFormat="mp3", VoiceId=voice, Engine="neural"
+        if random_voice:
+            voice = self.randomvoice()
+        else:
+            if not settings.config["settings"]["tts"]["aws_polly_voice"]:
+                raise ValueError(
+                    f"Please set the TOML variable AWS_VOICE to a valid voice. options are: {voices}"
                 )
-            except (BotoCoreError, ClientError) as error:
-                # The service returned an error, exit gracefully
-                print(error)
-                sys.exit(-1)
-
-            # Access the audio stream from the response
-            if "AudioStream" in response:
-                file = open(filepath, "wb")
-                file.write(response["AudioStream"].read())
-                file.close()
-                # print_substep(f"Saved Text {idx} to MP3 files successfully.", style="bold green")
-
-            else:
-                # The response didn't contain audio data, exit gracefully
-                print("Could not stream audio")
-                sys.exit(-1)
-        except ProfileNotFound:
-            print("You need to install the AWS CLI and configure your profile")
-            print(
-                """
-            Linux: https://docs.aws.amazon.com/polly/latest/dg/setup-aws-cli.html
-            Windows: https://docs.aws.amazon.com/polly/latest/dg/install-voice-plugin2.html
-            """
+            voice = str(settings.config["settings"]["tts"]["aws_polly_voice"]).capitalize()
+        try:
+            if len(text) > SYNC_MAX_CHARS:
+                self.run_task(text, filepath, voice)
+                return
+            response = _client("polly", self.endpoint_url).synthesize_speech(
+                Text=text, OutputFormat="mp3", VoiceId=voice, Engine="neural"
+            )
+            if "AudioStream" not in response:
+                raise AWSPollyException("AWS Polly did not return any audio")
+            with response["AudioStream"] as stream:
+                self.save(self.chunks(stream), filepath)
+        except (BotoCoreError, ClientError) as error:
+            raise AWSPollyException(f"AWS Polly failed: {error}") from error
+
+    def run_task(self, text: str, filepath: str, voice: str) -> None:
+        """Synthesizes a text too long for synthesize_speech with a speech synthesis task
+
+        The task writes the audio to the S3 bucket, from where it is downloaded and removed.
+        """
+        if not self.bucket:
+            raise AWSPollyException(
+                f"Texts longer than {SYNC_MAX_CHARS} characters need aws_polly_s3_bucket to be set"
             )
-            sys.exit(-1)
+        polly = _client("polly", self.endpoint_url)
+        task = polly.start_speech_synthesis_task(
+            Text=text,
+            OutputFormat="mp3",
+            VoiceId=voice,
+            Engine="neural",
+            OutputS3BucketName=self.bucket,
+            OutputS3KeyPrefix="reddit-video-maker/",
+        )["SynthesisTask"]
+        deadline = time.monotonic() + TASK_TIMEOUT
+        while task["TaskStatus"] in ("scheduled", "inProgress"):
+            if time.monotonic() > deadline:
+                raise AWSPollyException(f"Speech synthesis task {task['TaskId']} timed out")
+            time.sleep(TASK_POLL_INTERVAL)
+            task = polly.get_speech_synthesis_task(TaskId=task["TaskId"])["SynthesisTask"]
+        if task["TaskStatus"] != "completed":
+            raise AWSPollyException(
+                f"Speech synthesis task {task['TaskId']} failed: {task.get('TaskStatusReason')}"
+            )
+
+        # OutputUri is https://s3.<region>.amazonaws.com/<bucket>/<key>
+        key = urlparse(task["OutputUri"]).path.lstrip("/")
+        if key.startswith(f"{self.bucket}/"):
+            key = key[len(self.bucket) + 1 :]
+        s3 = _client("s3", self.endpoint_url)
+        with s3.get_object(Bucket=self.bucket, Key=key)["Body"] as stream:
+            self.save(self.chunks(stream), filepath)
+        try:
+            s3.delete_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            pass  # a leftover clip in the bucket is harmless
+
+    @staticmethod
+    def chunks(stream):
+        """Yields a botocore stream in chunks, so the audio is written as it arrives"""
+        return iter(lambda: stream.read(64 * 1024), b"")
+
 
-    def randomvoice(self):
-        return random.choice(self.voices)
+class AWSPollyException(Exception):
+    pass
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from utils import settings
+
+# The setting that holds the voice of every provider, by provider class name
+VOICE_SETTINGS = {
+    "TikTok": "tiktok_voice",
+    "AWSPolly": "aws_polly_voice",
+    "StreamlabsPolly": "streamlabs_polly_voice",
+    "elevenlabs": "elevenlabs_voice_name",
+    "pyttsx": "python_voice",
+}
+
+
+def provider_name(tts_module) -> str:
+    """Returns the name of a provider, or of every provider in a hedged chain"""
+    return getattr(tts_module, "name", type(tts_module).__name__)
+
+
+def configured_voice(tts_module) -> str:
+    """Returns the voice a provider is configured to read with, "random" with random_voice on"""
+    tts_config = settings.config["settings"]["tts"]
+    if tts_config["random_voice"]:
+        return "random"
+    if hasattr(tts_module, "providers"):  # a hedged chain reads with the voice of any provider
+        return "+".join(configured_voice(provider) for provider in tts_module.providers)
+    return str(tts_config.get(VOICE_SETTINGS.get(type(tts_module).__name__, ""), ""))
+
+
+class TTSCache:
+    """Content addressed cache of synthesized clips, kept across runs in assets/cache/tts
+
+    A clip is stored under the hash of the provider, voice, language and the final text, so the
+    same text read by the same voice is only ever paid for once. The cache is trimmed to its size
+    budget by evicting the least recently used clips.
+
+    Args:
+        directory (Optional): Where the clips are stored
+        max_bytes (Optional): Size budget of the cache
+    """
+
+    def __init__(self, directory: str = "assets/cache/tts", max_bytes: int = 500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(tts_module, text: str) -> str:
+        """Returns the cache key of a text read by the configured voice of a provider"""
+        provider = provider_name(tts_module)
+        # with random_voice on, any cached clip read by one of the provider's voices will do
+        voice = configured_voice(tts_module)
+        lang = settings.config["reddit"]["thread"]["post_lang"] or ""
+        identity = json.dumps([provider, voice, lang, text], ensure_ascii=False)
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def fetch(self, key: str, filepath: str) -> bool:
+        """Copies a cached clip to filepath
+
+        Returns:
+            bool: Whether the clip was cached
+        """
+        entry = self._entry(key)
+        try:
+            shutil.copyfile(entry, filepath)
+            os.utime(entry)  # the modification time orders the clips for eviction
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, filepath: str) -> None:
+        """Adds a synthesized clip to the cache"""
+        entry = self._entry(key)
+        temp_entry = f"{entry}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(filepath, temp_entry)
+            os.replace(temp_entry, entry)  # readers never see a partly written clip
+        except OSError:
+            pass
+
+    def evict(self) -> int:
+        """Removes the least recently used clips until the cache fits its size budget
+
+        Returns:
+            int: How many clips were removed
+        """
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            return removed
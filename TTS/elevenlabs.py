@@ -1,14 +1,24 @@
 import random
+import threading
+import time
 
-from elevenlabs import save
 from elevenlabs.client import ElevenLabs
 
+from TTS.provider import TTSProvider
 from utils import settings
 
+CATALOG_TTL = 3600  # seconds the voice catalog is reused before it is fetched again
+
+
+class elevenlabs(TTSProvider):
+    max_chars = 2500
+    max_concurrency = 3  # clips synthesized at the same time
+
+    # the voice catalog of the account, shared by every instance: (fetched at, name -> voice id)
+    _catalog = (0.0, {})
+    _lock = threading.Lock()
 
-class elevenlabs:
     def __init__(self):
-        self.max_chars = 2500
         self.client: ElevenLabs = None
 
     def run(self, text, filepath, random_voice: bool = False):
@@ -18,9 +28,15 @@ class elevenlabs:
             voice = self.randomvoice()
         else:
             voice = str(settings.config["settings"]["tts"]["elevenlabs_voice_name"]).capitalize()
+        voices = self.voice_ids()
+        if voice not in voices:
+            raise ValueError(f"Elevenlabs voice {voice} not found. options are: {list(voices)}")
 
-        audio = self.client.generate(text=text, voice=voice, model="eleven_multilingual_v1")
-        save(audio=audio, filename=filepath)
+        # a voice id instead of a name saves generate() from fetching the catalog itself
+        audio = self.client.generate(
+            text=text, voice=voices[voice], model="eleven_multilingual_v1", stream=True
+        )
+        self.save(audio, filepath)
 
     def initialize(self):
         if settings.config["settings"]["tts"]["elevenlabs_api_key"]:
@@ -32,7 +48,18 @@ class elevenlabs:
 
         self.client = ElevenLabs(api_key=api_key)
 
-    def randomvoice(self):
+    def voice_ids(self) -> dict:
+        """Returns the voice ids of the account by name, fetched at most once per CATALOG_TTL"""
         if self.client is None:
             self.initialize()
-        return random.choice(self.client.voices.get_all().voices).voice_name
+        with elevenlabs._lock:
+            fetched_at, catalog = elevenlabs._catalog
+            if time.monotonic() - fetched_at > CATALOG_TTL or not catalog:
+                catalog = {
+                    voice.name: voice.voice_id for voice in self.client.voices.get_all().voices
+                }
+                elevenlabs._catalog = (time.monotonic(), catalog)
+            return catalog
+
+    def randomvoice(self):
+        return random.choice(list(self.voice_ids()))
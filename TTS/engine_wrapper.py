@@ -1,23 +1,26 @@
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import List, Optional, Tuple
 
-import numpy as np
+import ffmpeg
 import translators
-from moviepy.audio.AudioClip import AudioClip
-from moviepy.audio.fx.volumex import volumex
-from moviepy.editor import AudioFileClip
 from rich.progress import track
 
+from TTS.cache import TTSCache
+from TTS.speech_rate import chars_per_second, record_speech_rate, select_within_budget
 from utils import settings
+from utils.audio import audio_info
 from utils.console import print_step, print_substep
+from utils.manifest import save_manifest
 from utils.voice import sanitize_text
 from utils.profanity_filter import filter_profanity
 
 DEFAULT_MAX_LENGTH: int = (
     50  # Video length variable, edit this on your own risk. It should work, but it's not supported
 )
+ENDING_TEXT: str = "What do you think? Comment below your thoughts"
 
 
 class TTSEngine:
@@ -30,7 +33,7 @@ class TTSEngine:
         max_length (Optional) : The maximum length of the mp3 files in total.
 
     Notes:
-        tts_module must take the arguments text and filepath.
+        tts_module must be a TTSProvider, which declares what the provider can do.
     """
 
     def __init__(
@@ -49,6 +52,9 @@ class TTSEngine:
         self.max_length = max_length
         self.length = 0
         self.last_clip_length = last_clip_length
+        self.clips = {}  # path -> duration/sample rate/size of every generated clip
+        cache_size = float(settings.get_setting("settings", "tts", "cache_size_mb"))
+        self.cache = TTSCache(max_bytes=int(cache_size * 1024 * 1024)) if cache_size > 0 else None
 
     def add_periods(
         self,
@@ -85,106 +91,326 @@ class TTSEngine:
                     self.reddit_object["comments"][idx]["comment_body"].encode("ascii", "ignore").decode()
                 )
 
-        # Generate title audio with profanity filtering
-        title_text = process_text(self.reddit_object["thread_title"])
-        title_text = filter_profanity(title_text)
-        self.call_tts("title", title_text)
-
-        # Generate content audio with profanity filtering
+        # (file name, text, whether the text still has to be cleaned) for every clip, in order
+        jobs = [("title", self.reddit_object["thread_title"], True)]
         if settings.config["settings"]["storymode"]:
             if settings.config["settings"]["storymodemethod"] == 0:
-                post_text = process_text(self.reddit_object["thread_post"])
-                post_text = filter_profanity(post_text)
-                self.call_tts("post", post_text)
+                jobs.append(("post", self.reddit_object["thread_post"], True))
                 number_of_comments = 1
             elif settings.config["settings"]["storymodemethod"] == 1:
                 for idx, text in enumerate(self.reddit_object["thread_post"]):
-                    processed_text = process_text(text)
-                    processed_text = filter_profanity(processed_text)
-                    self.call_tts(f"post-{idx}", processed_text)
+                    jobs.append((f"post-{idx}", text, True))
                 number_of_comments = len(self.reddit_object["thread_post"])
         else:
+            if self.max_length:
+                self.select_comments()
             for idx, comment in enumerate(self.reddit_object["comments"]):
-                comment_text = process_text(comment["comment_body"])
-                comment_text = filter_profanity(comment_text)
-                self.call_tts(idx, comment_text)
+                jobs.append((idx, comment["comment_body"], True))
             number_of_comments = len(self.reddit_object["comments"])
+        jobs.append(("ending", ENDING_TEXT, False))
+
+        # Network providers spend most of their time waiting, so several requests are made at
+        # once. Results are collected in job order, which keeps the totals deterministic
+        max_workers = (
+            int(settings.get_setting("settings", "tts", "max_concurrency"))
+            or self.tts_module.max_concurrency
+        )
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            texts = list(executor.map(lambda job: prepare_text(job[1], job[2]), jobs))
+            # Texts the provider can't take in one request are split on sentence boundaries,
+            # every chunk is synthesized on its own and the chunks are joined afterwards
+            parts = []  # (job index, file name, text)
+            for i, ((filename, _, _), text) in enumerate(zip(jobs, texts)):
+                chunks = split_text(text, self.tts_module.max_chars)
+                if len(chunks) == 1:
+                    parts.append((i, filename, chunks[0]))
+                else:
+                    parts.extend(
+                        (i, f"{filename}-{n}.part", chunk) for n, chunk in enumerate(chunks)
+                    )
+            if self.tts_module.supports_batch:
+                # local engines start up slower than they synthesize, so they get every clip
+                # in one call
+                results = self.batch_tts(parts)
+            else:
+                results = list(
+                    track(
+                        executor.map(lambda part: self.call_tts(part[1], part[2]), parts),
+                        "Generating TTS clips...",
+                        total=len(parts),
+                    )
+                )
 
-        # Generate ending audio
-        ending_text = "What do you think? Comment below your thoughts"
-        self.call_tts("ending", ending_text)
+        spoken_chars = 0
+        for i, (filename, _, _) in enumerate(jobs):
+            job_results = [result for part, result in zip(parts, results) if part[0] == i]
+            if len(job_results) == 1:
+                filepath, clip = job_results[0]
+            else:
+                filepath, clip = self.join_parts(filename, job_results)
+            if clip is None:
+                print_substep(f"Could not read the duration of {filepath}", style="bold red")
+                continue
+            self.last_clip_length = clip["duration"]
+            self.length += clip["duration"]
+            self.clips[os.path.normpath(filepath)] = clip
+            spoken_chars += len(texts[i])
+        # the next selection estimates durations with what this voice actually took
+        record_speech_rate(self.tts_module, spoken_chars, self.length)
+
+        # The renderer reads the clip durations from here instead of probing every file
+        save_manifest(self.redditid, self.clips)
+        if self.cache is not None:
+            self.cache.evict()
+            print_substep(
+                f"TTS cache: {self.cache.hits} clips reused, {self.cache.misses} synthesized"
+            )
+        # The clips are joined with a pause between them, which the video has to cover too
+        self.length += settings.config["settings"]["tts"]["silence_duration"] * (
+            len(self.clips) - 1
+        )
 
         print_step("TTS audio generated successfully! 🎉")
         return self.length, number_of_comments
 
-    def split_post(self, text: str, idx):
-        split_files = []
-        split_text = [
-            x.group().strip()
-            for x in re.finditer(
-                r" *(((.|\n){0," + str(self.tts_module.max_chars) + "})(\.|.$))", text
+    def select_comments(self) -> None:
+        """Drops the comments that won't fit in max_length seconds, before any of them is
+        synthesized or screenshotted. Durations are estimated from the character count and the
+        speech rate of the voice measured in previous runs.
+        """
+        comments = self.reddit_object["comments"]
+        rate = chars_per_second(self.tts_module)
+        gap = float(settings.config["settings"]["tts"]["silence_duration"])
+        # the title and the ending are always read
+        reserved = (
+            len(sanitize_text(self.reddit_object["thread_title"])) + len(ENDING_TEXT)
+        ) / rate + gap
+        picked = select_within_budget(
+            [len(sanitize_text(comment["comment_body"])) for comment in comments],
+            self.max_length,
+            rate,
+            reserved,
+            gap,
+        )
+        if len(picked) < len(comments):
+            print_substep(
+                f"Reading {len(picked)} of {len(comments)} comments to stay within "
+                f"{self.max_length} seconds"
             )
-        ]
-        self.create_silence_mp3()
+        self.reddit_object["comments"] = [comments[i] for i in picked]
 
-        idy = None
-        for idy, text_cut in enumerate(split_text):
-            newtext = process_text(text_cut)
-            # print(f"{idx}-{idy}: {newtext}\n")
+    def join_parts(self, filename, part_results: List[Tuple[str, Optional[dict]]]):
+        """Joins the chunks of a split text into one clip, with a short pause between them
 
-            if not newtext or newtext.isspace():
-                print("newtext was blank because sanitized split text resulted in none")
-                continue
-            else:
-                self.call_tts(f"{idx}-{idy}.part", newtext)
-                with open(f"{self.path}/list.txt", "w") as f:
-                    for idz in range(0, len(split_text)):
-                        f.write("file " + f"'{idx}-{idz}.part.mp3'" + "\n")
-                    split_files.append(str(f"{self.path}/{idx}-{idy}.part.mp3"))
-                    f.write("file " + f"'silence.mp3'" + "\n")
-
-                os.system(
-                    "ffmpeg -f concat -y -hide_banner -loglevel panic -safe 0 "
-                    + "-i "
-                    + f"{self.path}/list.txt "
-                    + "-c copy "
-                    + f"{self.path}/{idx}.mp3"
+        All chunks are decoded and joined by a single run of ffmpeg's concat filter, so the
+        encoder delay and padding of every part are dropped and the clip is exactly as long as its
+        parts and pauses. The price is one more lossy encode of the split clips only, clips that
+        fit in one request are used as the provider made them. It is done at a constant bitrate
+        close to the parts' own, so it adds little to what the provider's encode already lost.
+
+        Returns:
+            Tuple[str, Optional[dict]]: The clip path and its info, see call_tts
+        """
+        filepath = f"{self.path}/{filename}.mp3"
+        if any(info is None for _, info in part_results):
+            return filepath, None
+        part_paths = [part_path for part_path, _ in part_results]
+        first = audio_info(part_paths[0])
+        silence_duration = float(
+            settings.get_setting("settings", "tts", "chunk_silence_duration")
+        )
+        # a hedged call may have mixed providers, so every input is brought to the first's format
+        layout = "mono" if first.channels == 1 else "stereo"
+
+        def decoded(stream):
+            return stream.audio.filter(
+                "aformat", sample_rates=first.sample_rate, channel_layouts=layout
+            )
+
+        # the pause is generated in the graph and split into a copy for every gap
+        pauses = len(part_paths) - 1 if silence_duration > 0 else 0
+        silences = (
+            decoded(
+                ffmpeg.input(
+                    f"anullsrc=r={first.sample_rate}:cl={layout}", f="lavfi", t=silence_duration
                 )
+            ).filter_multi_output("asplit", pauses)
+            if pauses
+            else None
+        )
+        # the highest average bitrate of the parts, libmp3lame rounds it to a valid MP3 bitrate
+        kbps = max(
+            (
+                info["size"] * 8 / info["duration"] / 1000
+                for _, info in part_results
+                if info["duration"]
+            ),
+            default=128,
+        )
+        streams = []
+        for n, part_path in enumerate(part_paths):
+            if n and silences is not None:
+                streams.append(silences[n - 1])
+            streams.append(decoded(ffmpeg.input(part_path)))
         try:
-            for i in range(0, len(split_files)):
-                os.unlink(split_files[i])
-        except FileNotFoundError as e:
-            print("File not found: " + e.filename)
-        except OSError:
-            print("OSError")
+            ffmpeg.concat(*streams, v=0, a=1).output(
+                filepath, f="mp3", acodec="libmp3lame", audio_bitrate=f"{round(kbps)}k"
+            ).overwrite_output().run(quiet=True)
+            clip = audio_info(filepath)
+        except (OSError, ffmpeg.Error):
+            return filepath, None
+        finally:
+            for path in part_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        return filepath, {
+            "duration": clip.duration,
+            "sample_rate": clip.sample_rate,
+            "size": os.path.getsize(filepath),
+        }
 
     def call_tts(self, filename: str, text: str):
-        self.tts_module.run(
-            text,
-            filepath=f"{self.path}/{filename}.mp3",
-            random_voice=settings.config["settings"]["tts"]["random_voice"],
-        )
-        # try:
-        #     self.length += MP3(f"{self.path}/{filename}.mp3").info.length
-        # except (MutagenError, HeaderNotFoundError):
-        #     self.length += sox.file_info.duration(f"{self.path}/{filename}.mp3")
+        """Synthesizes one clip and measures it
+
+        Returns:
+            Tuple[str, Optional[dict]]: The clip path and its duration, sample rate and size,
+            or None if the clip could not be read
+        """
+        filepath = f"{self.path}/{filename}.mp3"
+        cached = self.fetch_cached(text, filepath)
+        if not cached:
+            synth_path = f"{self.path}/{filename}.{self.tts_module.output_formats[0]}"
+            self.tts_module.call(
+                text,
+                filepath=synth_path,
+                random_voice=settings.config["settings"]["tts"]["random_voice"],
+            )
+            to_mp3(synth_path, filepath)
+        return self.measure(text, filepath, cached)
+
+    def batch_tts(self, parts: List[Tuple[int, str, str]]):
+        """Synthesizes every clip missing from the cache with a single call of the provider's
+        run_batch, then measures them all
+
+        Returns:
+            List[Tuple[str, Optional[dict]]]: The results of call_tts, in the order of parts
+        """
+        filepaths = [f"{self.path}/{filename}.mp3" for _, filename, _ in parts]
+        cached = [self.fetch_cached(text, path) for (_, _, text), path in zip(parts, filepaths)]
+        native_format = self.tts_module.output_formats[0]
+        pending = [
+            (text, f"{os.path.splitext(path)[0]}.{native_format}", path)
+            for (_, _, text), path, hit in zip(parts, filepaths, cached)
+            if not hit
+        ]
+        if pending:
+            print_substep(f"Synthesizing {len(pending)} clips in one batch...")
+            self.tts_module.run_batch(
+                [(text, synth_path) for text, synth_path, _ in pending],
+                random_voice=settings.config["settings"]["tts"]["random_voice"],
+            )
+            for _, synth_path, filepath in pending:
+                to_mp3(synth_path, filepath)
+        return [
+            self.measure(text, path, hit)
+            for (_, _, text), path, hit in zip(parts, filepaths, cached)
+        ]
+
+    def fetch_cached(self, text: str, filepath: str) -> bool:
+        """Copies the clip of a text from the cache to filepath
+
+        Returns:
+            bool: Whether the clip was cached
+        """
+        if self.cache is None:
+            return False
+        return self.cache.fetch(TTSCache.key(self.tts_module, text), filepath)
+
+    def measure(self, text: str, filepath: str, cached: bool):
+        """Measures a clip and adds it to the cache if it was just synthesized
+
+        Returns:
+            Tuple[str, Optional[dict]]: See call_tts
+        """
         try:
-            clip = AudioFileClip(f"{self.path}/{filename}.mp3")
-            self.last_clip_length = clip.duration
-            self.length += clip.duration
-            clip.close()
-        except:
-            self.length = 0
-
-    def create_silence_mp3(self):
-        silence_duration = settings.config["settings"]["tts"]["silence_duration"]
-        silence = AudioClip(
-            make_frame=lambda t: np.sin(440 * 2 * np.pi * t),
-            duration=silence_duration,
-            fps=44100,
-        )
-        silence = volumex(silence, 0)
-        silence.write_audiofile(f"{self.path}/silence.mp3", fps=44100, verbose=False, logger=None)
+            # read from the file headers, ffprobe is only started for unusual files
+            clip = audio_info(filepath)
+            info = {
+                "duration": clip.duration,
+                "sample_rate": clip.sample_rate,
+                "size": os.path.getsize(filepath),
+            }
+            if self.cache is not None and not cached:
+                # only clips that could be read are worth keeping
+                self.cache.store(TTSCache.key(self.tts_module, text), filepath)
+            return filepath, info
+        except (OSError, ffmpeg.Error):
+            return filepath, None
+
+
+def to_mp3(synth_path: str, filepath: str) -> None:
+    """Moves a clip the provider wrote to filepath, converting it to mp3 if it is in any other
+    format, since the clips are cached and rendered as mp3
+    """
+    try:
+        codec = audio_info(synth_path).codec
+    except (OSError, ffmpeg.Error):
+        return  # the clip can't be read, which measuring it reports
+    if codec == "mp3":
+        if synth_path != filepath:
+            os.replace(synth_path, filepath)
+        return
+    source = f"{filepath}.src"  # ffmpeg can't convert a file onto itself
+    os.replace(synth_path, source)
+    try:
+        ffmpeg.input(source).output(
+            filepath, f="mp3", acodec="libmp3lame", **{"q:a": 2}
+        ).overwrite_output().run(quiet=True)
+    except ffmpeg.Error:
+        os.replace(source, filepath)  # still readable, only not converted
+        return
+    os.remove(source)
+
+
+def prepare_text(text: str, clean: bool = True) -> str:
+    """Translates, sanitizes and filters the text of a clip, unless it is a fixed line"""
+    if not clean:
+        return text
+    return filter_profanity(process_text(text))
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """Splits a text into chunks of at most max_chars characters
+    Chunks end on sentence boundaries where possible, overlong sentences are split between words.
+    Args:
+        text (str): The text to split
+        max_chars (int): The most characters the TTS provider takes at once
+    Returns:
+        List[str]: The chunks, in order
+    """
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text]
+
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars  # a single word longer than the limit
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    # sentences are packed together as long as they fit in one request
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] += " " + piece
+        else:
+            chunks.append(piece)
+    return chunks
 
 
 def process_text(text: str, clean: bool = True):
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from TTS.provider import TTSProvider
+from utils import settings
+from utils.console import print_substep
+
+LATENCY_PATH = "./video_creation/data/tts_latency.json"
+# Upper bounds in seconds of the latency histogram buckets, growing by half each
+BUCKETS = [round(0.25 * 1.5**k, 3) for k in range(16)]  # 0.25s up to about 2 minutes
+# Deadline of a provider with too few measured calls for a percentile
+DEFAULT_DEADLINE = 10.0
+MIN_SAMPLES = 20
+
+
+class LatencyHistogram:
+    """Per provider histograms of how long successful calls took, kept across runs in
+    video_creation/data/tts_latency.json
+    """
+
+    def __init__(self, path: str = LATENCY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.counts: Dict[str, List[int]] = json.load(f)
+        except (OSError, ValueError):
+            self.counts = {}
+
+    def record(self, provider: str, seconds: float) -> None:
+        """Adds a call to the histogram of a provider and saves the histograms"""
+        bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        with self._lock:
+            counts = self.counts.setdefault(provider, [0] * (len(BUCKETS) + 1))
+            counts[bucket] += 1
+            try:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(self.counts, f)
+            except OSError:
+                pass
+
+    def percentile(self, provider: str, percentile: float) -> Optional[float]:
+        """Returns the latency percentile of a provider, rounded up to its bucket bound
+
+        Returns:
+            Optional[float]: The latency in seconds, None with fewer than MIN_SAMPLES calls
+        """
+        with self._lock:
+            counts = list(self.counts.get(provider, []))
+        total = sum(counts)
+        if total < MIN_SAMPLES:
+            return None
+        seen = 0
+        for bound, count in zip(BUCKETS + [BUCKETS[-1] * 1.5], counts):
+            seen += count
+            if seen >= total * percentile / 100:
+                return bound
+        return BUCKETS[-1] * 1.5
+
+
+class HedgedTTS(TTSProvider):
+    """Reads each clip with the first provider of a chain and hedges against it stalling
+
+    When the current provider hasn't answered within its usual latency (a percentile of its
+    latency histogram), the same clip is also sent to the next provider of the chain, and the first
+    clip that arrives is used. A provider that fails hands over to the next one right away.
+
+    Args:
+        providers (List[type]): Provider classes, the primary one first
+    """
+
+    histogram = None  # shared by every instance, loaded on first use
+    _executor = ThreadPoolExecutor(max_workers=32)
+
+    def __init__(self, providers: List[type]):
+        self.providers = [provider() for provider in providers]
+        self.name = "+".join(type(provider).__name__ for provider in self.providers)
+        # every chunk has to fit each provider, the engine runs as many clips as the primary takes
+        self.max_chars = min(provider.max_chars for provider in self.providers)
+        self.max_concurrency = self.providers[0].max_concurrency
+        # a provider may write another format than the primary one, the engine converts it
+        self.output_formats = self.providers[0].output_formats
+        # the hedged calls of a provider count towards its own concurrency
+        self._slots = [
+            threading.BoundedSemaphore(provider.max_concurrency) for provider in self.providers
+        ]
+        self.percentile = float(settings.get_setting("settings", "tts", "hedge_percentile"))
+        if HedgedTTS.histogram is None:
+            HedgedTTS.histogram = LatencyHistogram()
+
+    def deadline(self, index: int) -> float:
+        """Returns how long to wait for a provider before hedging"""
+        latency = self.histogram.percentile(self.provider_name(index), self.percentile)
+        return DEFAULT_DEADLINE if latency is None else latency
+
+    def _attempt(self, index: int, text: str, filepath: str, random_voice: bool) -> str:
+        """Runs one provider, writing to a path of its own, and records its latency"""
+        provider = self.providers[index]
+        root, ext = os.path.splitext(filepath)
+        attempt_path = f"{root}.hedge-{index}{ext}"
+        with self._slots[index]:
+            start = time.monotonic()
+            provider.call(text, filepath=attempt_path, random_voice=random_voice)
+            self.histogram.record(self.provider_name(index), time.monotonic() - start)
+        return attempt_path
+
+    def run(self, text, filepath, random_voice: bool = False):
+        pending = {}  # future -> provider index
+        started_at = []  # when each provider was started
+        error = None
+
+        def start_next():
+            index = len(started_at)
+            started_at.append(time.monotonic())
+            future = self._executor.submit(self._attempt, index, text, filepath, random_voice)
+            pending[future] = index
+
+        start_next()
+        while pending:
+            newest = len(started_at) - 1
+            timeout = None  # with no provider left to hedge with, wait for whichever finishes
+            if len(started_at) < len(self.providers):
+                timeout = max(0.0, started_at[newest] + self.deadline(newest) - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                print_substep(
+                    f"{self.provider_name(newest)} is slow, "
+                    f"also trying {self.provider_name(newest + 1)}"
+                )
+                start_next()
+                continue
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    attempt_path = future.result()
+                except Exception as e:
+                    error = f"{self.provider_name(index)}: {e}"
+                    continue
+                os.replace(attempt_path, filepath)
+                # calls still running are left to finish, their clips are thrown away
+                for loser in pending:
+                    loser.add_done_callback(_discard)
+                return
+            # a provider failed, the next one takes over right away
+            if len(started_at) < len(self.providers):
+                print_substep(f"{error}, trying {self.provider_name(len(started_at))}")
+                start_next()
+        raise HedgedTTSException(f"Every TTS provider failed, last error: {error}")
+
+    def provider_name(self, index: int) -> str:
+        return type(self.providers[index]).__name__
+
+
+def _discard(future) -> None:
+    """Removes the clip of a call that lost the race"""
+    if future.exception() is None:
+        try:
+            os.remove(future.result())
+        except OSError:
+            pass
+
+
+class HedgedTTSException(Exception):
+    pass
@@ -0,0 +1,96 @@
+import os
+import random
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from utils.voice import TokenBucket
+
+
+class TTSProvider:
+    """Base class of the TTS providers, declaring what each one can do
+
+    TTSEngine plans a run from these instead of assuming them: texts are split to fit max_chars,
+    up to max_concurrency clips are synthesized at once, requests are spaced out to rate_limit,
+    batching providers get every clip in one run_batch call and clips in another format than mp3
+    are converted.
+
+    Attributes:
+        max_chars: The most characters the provider takes in one request
+        max_concurrency: Clips that may be synthesized at the same time
+        rate_limit: Requests per second the provider allows, 0 for no limit
+        rate_burst: Requests that may be made at once before rate_limit applies
+        supports_batch: Whether run_batch synthesizes many clips faster than run does one by one
+        output_formats: Audio formats the provider writes, the first one is used
+        voices: Voices randomvoice() picks from
+    """
+
+    max_chars: int = 5000
+    max_concurrency: int = 1
+    rate_limit: float = 0
+    rate_burst: int = 1
+    supports_batch: bool = False
+    output_formats: Tuple[str, ...] = ("mp3",)
+    voices: List = []
+
+    _limiters = {}  # provider class -> its TokenBucket, shared by every instance
+    _limiters_lock = threading.Lock()
+
+    def run(self, text: str, filepath: str, random_voice: bool = False) -> None:
+        """Synthesizes text to filepath, in the first of output_formats
+
+        Args:
+            text (str): The text to read, at most max_chars characters
+            filepath (str): Where to write the audio
+            random_voice (Optional): Whether to read with a random voice instead of the configured
+        """
+        raise NotImplementedError
+
+    def run_batch(self, jobs: List[Tuple[str, str]], random_voice: bool = False) -> None:
+        """Synthesizes many clips, one after another unless the provider supports batches
+
+        Args:
+            jobs (List[Tuple[str, str]]): (text, filepath) of every clip
+            random_voice (Optional): Whether every clip is read by a random voice
+        """
+        for text, filepath in jobs:
+            self.run(text, filepath, random_voice=random_voice)
+
+    def limiter(self) -> Optional[TokenBucket]:
+        """Returns the rate limiter shared by every instance of the provider, None without
+        a rate_limit
+        """
+        if not self.rate_limit:
+            return None
+        with TTSProvider._limiters_lock:
+            if type(self) not in TTSProvider._limiters:
+                TTSProvider._limiters[type(self)] = TokenBucket(self.rate_limit, self.rate_burst)
+            return TTSProvider._limiters[type(self)]
+
+    def call(self, text: str, filepath: str, random_voice: bool = False) -> None:
+        """Runs the provider once its rate limit allows another request"""
+        limiter = self.limiter()
+        if limiter is not None:
+            limiter.acquire()
+        self.run(text, filepath, random_voice=random_voice)
+
+    @staticmethod
+    def save(chunks: Iterable[bytes], filepath: str) -> None:
+        """Writes audio to filepath chunk by chunk, as it arrives
+
+        The chunks go to a temporary file that only replaces filepath once all of them are
+        written, so a failed download never leaves a partial clip behind.
+        """
+        temp_path = f"{filepath}.part"
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+            os.replace(temp_path, filepath)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def randomvoice(self):
+        return random.choice(self.voices)
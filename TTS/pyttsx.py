@@ -1,42 +1,114 @@
-import random
-
-import pyttsx3
+import atexit
+import os
+import pickle
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import List, Tuple
 
+from TTS.provider import TTSProvider
 from utils import settings
+from utils.console import print_substep
+
+
+class pyttsx(TTSProvider):
+    max_chars = 5000
+    max_concurrency = 1  # the pyttsx3 engine is not thread safe
+    supports_batch = True
+    output_formats = ("wav",)  # espeak and SAPI5 write WAV, whatever the file is named
 
+    # one engine process is shared by every instance, starting an engine takes longer than
+    # synthesizing most clips
+    _process = None
+    _lock = threading.Lock()
 
-class pyttsx:
     def __init__(self):
-        self.max_chars = 5000
         self.voices = []
 
+    def voice_settings(self) -> int:
+        """Reads the voice settings and returns the configured voice index"""
+        voice_id = settings.config["settings"]["tts"]["python_voice"]
+        voice_num = settings.config["settings"]["tts"]["py_voice_num"]
+        if voice_id == "" or voice_num == "":
+            print_substep(
+                "Set pyttsx values to a valid value, switching to defaults", style="bold red"
+            )
+            voice_id = 1
+            voice_num = 2
+        self.voices = list(range(int(voice_num)))
+        return int(voice_id)
+
     def run(
         self,
         text: str,
         filepath: str,
         random_voice=False,
     ):
-        voice_id = settings.config["settings"]["tts"]["python_voice"]
-        voice_num = settings.config["settings"]["tts"]["py_voice_num"]
-        if voice_id == "" or voice_num == "":
-            voice_id = 2
-            voice_num = 3
-            raise ValueError("set pyttsx values to a valid value, switching to defaults")
-        else:
-            voice_id = int(voice_id)
-            voice_num = int(voice_num)
-        for i in range(voice_num):
-            self.voices.append(i)
-            i = +1
-        if random_voice:
-            voice_id = self.randomvoice()
-        engine = pyttsx3.init()
-        voices = engine.getProperty("voices")
-        engine.setProperty(
-            "voice", voices[voice_id].id
-        )  # changing index changes voices but ony 0 and 1 are working here
-        engine.save_to_file(text, f"{filepath}")
-        engine.runAndWait()
-
-    def randomvoice(self):
-        return random.choice(self.voices)
+        self.run_batch([(text, filepath)], random_voice)
+
+    def run_batch(self, jobs: List[Tuple[str, str]], random_voice=False) -> None:
+        """Synthesizes many clips with a single runAndWait of the engine
+
+        Args:
+            jobs (List[Tuple[str, str]]): (text, filepath) of every clip
+            random_voice (Optional): Whether every clip is read by a random voice
+        """
+        voice_id = self.voice_settings()
+        # changing index changes voices but ony 0 and 1 are working here
+        batch = [
+            (text, os.path.abspath(filepath), self.randomvoice() if random_voice else voice_id)
+            for text, filepath in jobs
+        ]
+        with pyttsx._lock:
+            try:
+                error = self._send(batch)
+            except (EOFError, OSError, pickle.UnpicklingError):
+                # the engine process died, a fresh one gets the batch once more
+                self._stop()
+                try:
+                    error = self._send(batch)
+                except (EOFError, OSError, pickle.UnpicklingError):
+                    # e.g. pyttsx3 is not installed, the engine process printed why
+                    self._stop()
+                    raise pyttsxException("The pyttsx3 engine process exited")
+        if error is not None:
+            raise pyttsxException(f"pyttsx3 failed: {error}")
+
+    @classmethod
+    def _send(cls, batch):
+        if cls._process is None or cls._process.poll() is not None:
+            # a fresh interpreter that only imports the worker module, not the bot's main script
+            cls._process = subprocess.Popen(
+                [sys.executable, "-m", "TTS.pyttsx_worker"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                cwd=Path(__file__).resolve().parent.parent,
+            )
+        pickle.dump(batch, cls._process.stdin)
+        cls._process.stdin.flush()
+        return pickle.load(cls._process.stdout)
+
+    @classmethod
+    def _stop(cls) -> None:
+        """Shuts the engine process down"""
+        if cls._process is None:
+            return
+        try:
+            pickle.dump(None, cls._process.stdin)
+            cls._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            cls._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            cls._process.kill()
+        cls._process.stdout.close()
+        cls._process = None
+
+
+class pyttsxException(Exception):
+    pass
+
+
+atexit.register(pyttsx._stop)
@@ -0,0 +1,48 @@
+"""Entry point of the pyttsx engine process, started by TTS.pyttsx with python -m
+
+It is kept apart from the rest of the bot, so the process only imports pyttsx3 rather than
+whichever script started the bot.
+"""
+import os
+import pickle
+import sys
+
+import pyttsx3
+
+
+def main() -> None:
+    """Keeps one engine alive and synthesizes the batches sent to it over stdin
+
+    Every batch is a list of (text, filepath, voice index), the reply on stdout is None or the
+    error. None instead of a batch shuts the engine down.
+    """
+    # the replies get the real stdout to themselves, anything the engine prints goes to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    requests = sys.stdin.buffer
+
+    engine = pyttsx3.init()
+    voices = engine.getProperty("voices")
+    while True:
+        try:
+            batch = pickle.load(requests)
+        except EOFError:
+            return
+        if batch is None:
+            return
+        try:
+            # property changes are queued with the utterances, so each one keeps its voice
+            for text, filepath, voice_id in batch:
+                engine.setProperty("voice", voices[voice_id].id)
+                engine.save_to_file(text, filepath)
+            engine.runAndWait()
+            reply = None
+        except Exception as e:
+            reply = f"{type(e).__name__}: {e}"
+        pickle.dump(reply, replies)
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()
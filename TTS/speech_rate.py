@@ -0,0 +1,76 @@
+import json
+from typing import Dict, List
+
+from TTS.cache import configured_voice, provider_name
+
+RATES_PATH = "./video_creation/data/speech_rates.json"
+# Characters per second of a voice that wasn't measured yet, a typical rate for English TTS
+DEFAULT_CHARS_PER_SECOND = 15.0
+# Weight of the latest run in the learned rate
+SMOOTHING = 0.3
+
+
+def voice_key(tts_module) -> str:
+    """Returns the name a voice's speech rate is stored under"""
+    return f"{provider_name(tts_module)}:{configured_voice(tts_module)}"
+
+
+def _load_rates() -> Dict[str, float]:
+    try:
+        with open(RATES_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def chars_per_second(tts_module) -> float:
+    """Returns how many characters per second the configured voice reads, learned from past runs"""
+    return _load_rates().get(voice_key(tts_module), DEFAULT_CHARS_PER_SECOND)
+
+
+def record_speech_rate(tts_module, chars: int, seconds: float) -> None:
+    """Updates the learned speech rate of the configured voice with the clips of a run
+
+    Args:
+        tts_module: The TTS provider
+        chars (int): Number of characters synthesized
+        seconds (float): Total duration of the synthesized clips
+    """
+    if chars <= 0 or seconds <= 0:
+        return
+    rates = _load_rates()
+    key = voice_key(tts_module)
+    measured = chars / seconds
+    previous = rates.get(key)
+    rates[key] = measured if previous is None else previous + SMOOTHING * (measured - previous)
+    with open(RATES_PATH, "w", encoding="utf-8") as f:
+        json.dump(rates, f, indent=4)
+
+
+def select_within_budget(
+    lengths: List[int], budget: float, rate: float, reserved: float = 0, gap: float = 0
+) -> List[int]:
+    """Picks the texts that fit a duration budget, in rank order
+
+    Texts are taken in order as long as their estimated duration still fits, texts that don't fit
+    are skipped in favour of shorter ones further down. The first text is always picked, so the
+    selection is never empty.
+
+    Args:
+        lengths (List[int]): Character count of every text, best ranked first
+        budget (float): Seconds available
+        rate (float): Characters per second of the voice
+        reserved (float): Seconds already taken by other clips
+        gap (float): Seconds of silence that follow every clip
+
+    Returns:
+        List[int]: Indices of the picked texts, in order
+    """
+    remaining = budget - reserved
+    picked = []
+    for i, length in enumerate(lengths):
+        estimate = length / rate + gap
+        if estimate <= remaining or not picked:
+            picked.append(i)
+            remaining -= estimate
+    return picked
@@ -1,10 +1,10 @@
-import random
+import time
 
 import requests
-from requests.exceptions import JSONDecodeError
 
+from TTS.provider import TTSProvider
 from utils import settings
-from utils.voice import check_ratelimit
+from utils.voice import backoff_delay, pooled_session
 
 voices = [
     "Brian",
@@ -28,11 +28,21 @@ voices = [
 # valid voices https://lazypy.ro/tts/
 
 
-class StreamlabsPolly:
+class StreamlabsPolly(TTSProvider):
+    max_chars = 550
+    max_concurrency = 2  # the endpoint rate limits aggressively
+    rate_limit = 1
+    rate_burst = 2
+    voices = voices
+
     def __init__(self):
         self.url = "https://streamlabs.com/polly/speak"
-        self.max_chars = 550
-        self.voices = voices
+        self.max_retries = 5
+        self.timeout = (5, 30)  # seconds to connect, seconds to read
+        self._session = pooled_session(
+            int(settings.get_setting("settings", "tts", "max_concurrency")) or self.max_concurrency
+        )
+        self._session.headers["Referer"] = "https://streamlabs.com/"
 
     def run(self, text, filepath, random_voice: bool = False):
         if random_voice:
@@ -45,23 +55,53 @@ class StreamlabsPolly:
             voice = str(settings.config["settings"]["tts"]["streamlabs_polly_voice"]).capitalize()
 
         body = {"voice": voice, "text": text, "service": "polly"}
-        headers = {"Referer": "https://streamlabs.com/"}
-        response = requests.post(self.url, headers=headers, data=body)
+        for attempt in range(self.max_retries + 1):
+            if attempt:  # the first request was already let through by call()
+                self.limiter().acquire()
+            try:
+                response = self._session.post(self.url, data=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+                time.sleep(backoff_delay(attempt))
+                continue
 
-        if not check_ratelimit(response):
-            self.run(text, filepath, random_voice)
+            if response.status_code == 429:
+                error = "rate limited"
+                try:
+                    reset = float(response.headers["X-RateLimit-Reset"])
+                except (KeyError, ValueError):  # no reset time given, back off instead
+                    reset = time.time() + backoff_delay(attempt, base=2)
+                print(f"Ratelimit hit. Waiting {max(0, reset - time.time()):.0f} seconds.")
+                self.limiter().pause_until(reset)
+                continue
+            if response.status_code >= 500:
+                error = f"HTTP {response.status_code}"
+                time.sleep(backoff_delay(attempt))
+                continue
 
-        else:
             try:
-                voice_data = requests.get(response.json()["speak_url"])
-                with open(filepath, "wb") as f:
-                    f.write(voice_data.content)
-            except (KeyError, JSONDecodeError):
-                try:
-                    if response.json()["error"] == "No text specified!":
-                        raise ValueError("Please specify a text to convert to speech.")
-                except (KeyError, JSONDecodeError):
-                    print("Error occurred calling Streamlabs Polly")
+                data = response.json()
+            except ValueError:
+                error = f"HTTP {response.status_code} with a non JSON body"
+                time.sleep(backoff_delay(attempt))
+                continue
+            if "speak_url" not in data:
+                if data.get("error") == "No text specified!":
+                    raise ValueError("Please specify a text to convert to speech.")
+                raise StreamlabsPollyException(f"Error occurred calling Streamlabs Polly: {data}")
+            self.download(data["speak_url"], filepath)
+            return
+
+        raise StreamlabsPollyException(
+            f"Streamlabs Polly failed {self.max_retries + 1} times, last error: {error}"
+        )
+
+    def download(self, url: str, filepath: str) -> None:
+        """Streams the audio to filepath in chunks, the file only appears once it is complete"""
+        with self._session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            self.save(response.iter_content(chunk_size=64 * 1024), filepath)
+
 
-    def randomvoice(self):
-        return random.choice(self.voices)
+class StreamlabsPollyException(Exception):
+    pass
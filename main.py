@@ -60,6 +60,8 @@ def main(POST_ID=None) -> None:
     
     # Create the video
     video_path = make_final_video(number_of_comments, length, reddit_object, bg_config)
+    if settings.config["settings"]["render"]["dry_run"]:
+        return  # only the render plan was written, there is no video to upload
     
     # Upload to YouTube
     print_step("Uploading video to YouTube...")
@@ -0,0 +1,284 @@
+import os
+import struct
+import wave
+from typing import Final, List, NamedTuple, Optional, Tuple
+
+import ffmpeg
+import numpy as np
+
+# Every clip is decoded to this format, so the arrays can be joined and mixed directly
+SAMPLE_RATE: Final[int] = 44100
+CHANNELS: Final[int] = 2
+
+
+class AudioInfo(NamedTuple):
+    duration: float  # seconds
+    sample_rate: int
+    channels: int
+    codec: str  # ffmpeg codec name, e.g. mp3 or pcm_s16le
+
+
+# MPEG audio header tables, indexed by the version bits (0: 2.5, 2: 2, 3: 1) of the frame header
+_MPEG_SAMPLE_RATES: Final[dict] = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+# kbps by (MPEG1, layer) and (MPEG2/2.5, layer), indexed by the bitrate bits
+_MPEG_BITRATES: Final[dict] = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+
+# Only this much of a file is read to find its headers
+HEADER_BYTES: Final[int] = 65536
+
+
+def _mpeg_frame(data: bytes, offset: int) -> Optional[Tuple[int, int, int, int, bool, bool]]:
+    """Parses the MPEG audio frame header at offset
+
+    Returns:
+        Optional[Tuple[int, int, int, int, bool, bool]]: (frame length, samples per frame,
+        sample rate, bitrate, MPEG1, mono), or None if there is no valid header at offset
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[offset + 1] >> 3) & 3
+    layer = 4 - ((data[offset + 1] >> 1) & 3)
+    bitrate_index = data[offset + 2] >> 4
+    rate_index = (data[offset + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _MPEG_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (data[offset + 2] >> 1) & 1
+    mono = data[offset + 3] >> 6 == 3
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+        return length, 384, sample_rate, bitrate, mpeg1, mono
+    samples = 576 if layer == 3 and not mpeg1 else 1152
+    length = samples // 8 * bitrate // sample_rate + padding
+    return length, samples, sample_rate, bitrate, mpeg1, mono
+
+
+def _mp3_info(f, file_size: int) -> Optional[AudioInfo]:
+    # ID3v2 tags are skipped, their size is a 28 bit syncsafe integer. Tags with cover art can
+    # be large, so the file is read from the end of the tags on
+    start = 0
+    while True:
+        f.seek(start)
+        tag = f.read(10)
+        if len(tag) < 10 or tag[:3] != b"ID3":
+            break
+        size = 0
+        for byte in tag[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        start += 10 + size + (10 if tag[5] & 0x10 else 0)
+    f.seek(start)
+    data = f.read(HEADER_BYTES)
+
+    # the first frame is the first header followed by another valid header, or the end of what
+    # was read
+    first = None
+    offset = 0
+    while offset < len(data) - 4:
+        frame = _mpeg_frame(data, offset)
+        if frame is not None and (
+            offset + frame[0] + 4 > len(data) or _mpeg_frame(data, offset + frame[0]) is not None
+        ):
+            first = frame
+            break
+        offset += 1
+    if first is None:
+        return None
+    length, samples, sample_rate, bitrate, mpeg1, mono = first
+    channels = 1 if mono else 2
+
+    # VBR encoders put the number of frames in a Xing/Info or VBRI header in the first frame
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    xing = offset + 4 + side_info
+    if data[xing : xing + 4] in (b"Xing", b"Info"):
+        (flags,) = struct.unpack(">I", data[xing + 4 : xing + 8])
+        if flags & 1:
+            (frames,) = struct.unpack(">I", data[xing + 8 : xing + 12])
+            total = frames * samples
+            # the LAME extension records the encoder delay and padding, which decoders drop
+            # it follows the optional frames, bytes, TOC and quality fields
+            lame = xing + 8 + sum(
+                size for bit, size in ((1, 4), (2, 4), (4, 100), (8, 4)) if flags & bit
+            )
+            if data[lame : lame + 4] in (b"LAME", b"Lavc", b"Lavf"):
+                gapless = data[lame + 21 : lame + 24]
+                delay = (gapless[0] << 4) | (gapless[1] >> 4)
+                padding = ((gapless[1] & 0x0F) << 8) | gapless[2]
+                if delay + padding < total:
+                    total -= delay + padding
+            return AudioInfo(total / sample_rate, sample_rate, channels, "mp3")
+    vbri = offset + 4 + 32
+    if data[vbri : vbri + 4] == b"VBRI":
+        (frames,) = struct.unpack(">I", data[vbri + 14 : vbri + 18])
+        return AudioInfo(frames * samples / sample_rate, sample_rate, channels, "mp3")
+
+    # otherwise the file is taken to be CBR, which makes its length follow from its size
+    audio_bytes = file_size - start - offset
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b"TAG":  # ID3v1 tag at the end
+        audio_bytes -= 128
+    return AudioInfo(audio_bytes * 8 / bitrate, sample_rate, channels, "mp3")
+
+
+def _wav_info(f, file_size: int) -> Optional[AudioInfo]:
+    offset = 12
+    codec = channels = sample_rate = byte_rate = None
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(24)
+        chunk_id = header[:4]
+        (size,) = struct.unpack("<I", header[4:8])
+        if chunk_id == b"fmt ":
+            format_tag, channels, sample_rate, byte_rate, _, bits = struct.unpack(
+                "<HHIIHH", header[8:24]
+            )
+            # 1 is integer PCM, 0xFFFE is WAVE_FORMAT_EXTENSIBLE which TTS engines use for PCM too
+            codec = f"pcm_s{bits}le" if format_tag in (1, 0xFFFE) and bits > 8 else "pcm_u8"
+        elif chunk_id == b"data" and byte_rate:
+            # streaming writers leave the size unset, the data then runs to the end of the file
+            size = min(size, file_size - offset - 8)
+            return AudioInfo(size / byte_rate, sample_rate, channels, codec)
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def audio_info(path: str) -> AudioInfo:
+    """Reads the duration, sample rate and channel count of an audio file
+
+    MP3 and WAV files are measured from their headers, only the first HEADER_BYTES after any ID3
+    tags are read. Anything else is probed with ffprobe.
+
+    Args:
+        path (str): Path of the audio file
+
+    Returns:
+        AudioInfo: The duration in seconds, the sample rate, the number of channels and the codec
+
+    Raises:
+        ffmpeg.Error: If the file is no MP3/WAV file and ffprobe cannot read it either
+    """
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        magic = f.read(12)
+        try:
+            if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+                info = _wav_info(f, file_size)
+            else:
+                info = _mp3_info(f, file_size)
+        except struct.error:  # truncated header
+            info = None
+    if info is not None and info.duration > 0:
+        return info
+    probe = ffmpeg.probe(path)
+    stream = next(
+        (stream for stream in probe["streams"] if stream.get("codec_type") == "audio"), {}
+    )
+    return AudioInfo(
+        float(probe["format"]["duration"]),
+        int(stream.get("sample_rate", 0)),
+        int(stream.get("channels", 0)),
+        stream.get("codec_name", ""),
+    )
+
+
+def audio_duration(path: str) -> float:
+    """Returns the duration of an audio file in seconds, see audio_info"""
+    return audio_info(path).duration
+
+
+def decode_pcm(path: str) -> np.ndarray:
+    """Decodes an audio file to 16 bit PCM at SAMPLE_RATE with CHANNELS channels
+
+    Args:
+        path (str): Path of the audio file
+
+    Returns:
+        np.ndarray: int16 samples shaped (frames, CHANNELS)
+    """
+    out, _ = (
+        ffmpeg.input(path)
+        .output("pipe:", f="s16le", acodec="pcm_s16le", ac=CHANNELS, ar=SAMPLE_RATE)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, dtype=np.int16).reshape(-1, CHANNELS)
+
+
+def write_wav(path: str, samples: np.ndarray) -> None:
+    """Writes int16 samples shaped (frames, CHANNELS) to a WAV file
+
+    Args:
+        path (str): Where to save the file
+        samples (np.ndarray): The samples to write
+    """
+    with wave.open(path, "wb") as f:
+        f.setnchannels(CHANNELS)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def assemble_audio(
+    clip_paths: List[str],
+    voice_path: str,
+    gap: float = 0,
+    background_path: Optional[str] = None,
+    background_volume: float = 0,
+    mixed_path: Optional[str] = None,
+) -> Tuple[List[float], str]:
+    """Joins the TTS clips into one lossless track and mixes in the background audio
+
+    Every clip is decoded once, the clips are joined with `gap` seconds of silence between them,
+    and the background is added at `background_volume`, at the levels ffmpeg's amix gave them.
+    Nothing is encoded until the final mux.
+
+    Args:
+        clip_paths (List[str]): The TTS clips in playback order
+        voice_path (str): Where to save the joined TTS track
+        gap (float): Seconds of silence between two clips
+        background_path (Optional[str]): The background audio, if any
+        background_volume (float): Volume of the background audio, 0 leaves it out
+        mixed_path (Optional[str]): Where to save the mixed track
+
+    Returns:
+        Tuple[List[float], str]: How long every clip plays including the gap after it,
+        and the path of the track to use in the video
+    """
+    gap_frames = round(gap * SAMPLE_RATE)
+    silence = np.zeros((gap_frames, CHANNELS), dtype=np.int16)
+
+    parts = []
+    durations = []
+    for i, clip_path in enumerate(clip_paths):
+        samples = decode_pcm(clip_path)
+        parts.append(samples)
+        frames = len(samples)
+        if gap_frames and i < len(clip_paths) - 1:
+            parts.append(silence)
+            frames += gap_frames
+        durations.append(frames / SAMPLE_RATE)
+    voice = np.concatenate(parts)
+    write_wav(voice_path, voice)
+
+    if not background_path or background_volume <= 0 or mixed_path is None:
+        return durations, voice_path
+
+    background = decode_pcm(background_path)[: len(voice)]
+    mixed = voice.astype(np.float32)
+    # scaled by 1/2 like ffmpeg's amix of two inputs, which keeps the old levels and can't clip
+    mixed[: len(background)] += background.astype(np.float32) * background_volume
+    mixed[: len(background)] /= 2
+    write_wav(mixed_path, np.round(mixed).astype(np.int16))
+    return durations, mixed_path
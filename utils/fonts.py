@@ -1,4 +1,43 @@
-from PIL.ImageFont import FreeTypeFont, ImageFont
+import os
+from functools import lru_cache
+
+from PIL import Image
+from PIL.ImageFont import FreeTypeFont, ImageFont, truetype
+
+
+@lru_cache(maxsize=32)
+def get_font(path: str, size: int) -> FreeTypeFont:
+    """Loads a TrueType font once per (path, size) for the whole process
+
+    Fonts are only read by Pillow's drawing functions, so the cached object is shared.
+
+    Args:
+        path (str): Path of the font file
+        size (int): Font size in points
+
+    Returns:
+        FreeTypeFont: The loaded font
+    """
+    return truetype(path, size)
+
+
+@lru_cache(maxsize=8)
+def _decode_image(path: str, mtime: float) -> Image.Image:
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+def get_image(path: str) -> Image.Image:
+    """Returns a decoded template image, decoding the file only when it is new or was changed
+
+    Args:
+        path (str): Path of the image
+
+    Returns:
+        Image: A copy of the cached image, which the caller is free to draw on
+    """
+    return _decode_image(path, os.path.getmtime(path)).copy()
 
 
 def getsize(font: ImageFont | FreeTypeFont, text: str):
@@ -2,11 +2,45 @@ import os
 import re
 import textwrap
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from rich.progress import track
 
 from TTS.engine_wrapper import process_text
-from utils.fonts import getheight, getsize
+from utils.fonts import get_font, getheight, getsize
+
+
+def overlay_width(W: int) -> int:
+    """Returns the width the screenshots and slides are shown at in a video W pixels wide"""
+    return int((W * 65) // 100)
+
+
+def fit_overlay(image: Image.Image, width: int, opacity: float = 1) -> Image.Image:
+    """Scales an image to its on-screen width and bakes its opacity into the alpha channel,
+    so the render only has to position it.
+
+    Args:
+        image (Image): The overlay image
+        width (int): The width it is shown at
+        opacity (float): How opaque it is shown
+
+    Returns:
+        Image: The prepared RGBA image
+    """
+    image = image.convert("RGBA")
+    if image.width != width:
+        image = image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS
+        )
+    if opacity < 1:
+        image.putalpha(image.getchannel("A").point(lambda alpha: round(alpha * opacity)))
+    return image
+
+
+def prepare_overlay(image_path: str, width: int, opacity: float = 1) -> None:
+    """Rewrites an overlay image on disk with fit_overlay"""
+    with Image.open(image_path) as image:
+        prepared = fit_overlay(image, width, opacity)
+    prepared.save(image_path)
 
 
 def draw_multiple_line_text(
@@ -78,19 +112,21 @@ def draw_multiple_line_text(
         y += line_height + padding
 
 
-def imagemaker(theme, reddit_obj: dict, txtclr, padding=5, transparent=False) -> None:
+def imagemaker(
+    theme, reddit_obj: dict, txtclr, padding=5, transparent=False, width: int = 0
+) -> None:
     """
-    Render Images for video
+    Render Images for video, scaled to the overlay width when one is given
     """
     texts = reddit_obj["thread_post"]
     id = re.sub(r"[^\w\s-]", "", reddit_obj["thread_id"])
 
     if transparent:
         # Increase font size for better visibility
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), 120)
+        font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), 120)
     else:
         # Increase font size for better visibility
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), 120)
+        font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), 120)
     size = (1920, 1080)
 
     image = Image.new("RGBA", size, theme)
@@ -99,4 +135,6 @@ def imagemaker(theme, reddit_obj: dict, txtclr, padding=5, transparent=False) ->
         image = Image.new("RGBA", size, theme)
         text = process_text(text, False)
         draw_multiple_line_text(image, text, font, txtclr, padding, wrap=30, transparent=transparent)
+        if width:
+            image = fit_overlay(image, width)
         image.save(f"assets/temp/{id}/png/img{idx}.png")
@@ -0,0 +1,53 @@
+import json
+import os
+from typing import Dict, Optional
+
+
+def manifest_path(reddit_id: str) -> str:
+    """Returns where the clip manifest of a thread is stored"""
+    return f"assets/temp/{reddit_id}/manifest.json"
+
+
+def save_manifest(reddit_id: str, clips: Dict[str, dict]) -> None:
+    """Writes the clip manifest of a thread to assets/temp/{reddit_id}/manifest.json
+
+    Args:
+        reddit_id (str): The ID of the thread
+        clips (Dict[str, dict]): Clip path -> {"duration", "sample_rate", "size"}
+    """
+    with open(manifest_path(reddit_id), "w", encoding="utf-8") as f:
+        json.dump({"clips": clips}, f, indent=4)
+
+
+def load_manifest(reddit_id: str) -> Dict[str, dict]:
+    """Reads the clip manifest of a thread
+
+    Returns:
+        Dict[str, dict]: Clip path -> clip info. Empty if there is no usable manifest
+    """
+    try:
+        with open(manifest_path(reddit_id), "r", encoding="utf-8") as f:
+            return json.load(f)["clips"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def manifest_duration(clips: Dict[str, dict], file_path: str) -> Optional[float]:
+    """Returns the duration recorded for a clip, as long as the file wasn't changed since
+
+    Args:
+        clips (Dict[str, dict]): The loaded manifest
+        file_path (str): Path of the clip
+
+    Returns:
+        Optional[float]: The duration in seconds, or None if the clip has to be probed
+    """
+    clip = clips.get(os.path.normpath(file_path))
+    if clip is None:
+        return None
+    try:
+        if os.path.getsize(file_path) != clip["size"]:
+            return None
+    except OSError:
+        return None
+    return clip["duration"]
@@ -71,22 +71,19 @@ def filter_profanity(text: str) -> str:
     """
     if not text:
         return text
-        
-    # Split text into words while preserving punctuation
-    words = re.findall(r'\b\w+\b|[^\w\s]', text)
-    
-    # Process each word
-    for i, word in enumerate(words):
+
+    def censor_match(match: re.Match) -> str:
+        word = match.group()
         # Skip if not a word or too short
         if not word.isalpha() or len(word) < 3:
-            continue
-            
+            return word
         # Check if word (case-insensitive) is in profanity list
         if word.lower() in PROFANITY_LIST:
-            words[i] = censor_word(word)
-    
-    # Reconstruct the text
-    return ''.join(words)
+            return censor_word(word)
+        return word
+
+    # Only the words are replaced, so the whitespace between them is kept
+    return re.sub(r'\b\w+\b', censor_match, text)
 
 def filter_profanity_list(texts: List[str]) -> List[str]:
     """Filter profanity from a list of texts."""
@@ -0,0 +1,102 @@
+import multiprocessing
+from typing import Dict, Final, Tuple
+
+from utils import settings
+
+# Every profile sets x264 rate control (CRF, optionally capped with VBV), the x264 preset,
+# the output frame rate (0 keeps the background's), the pixel format and a resolution scale
+RENDER_PROFILES: Final[Dict[str, dict]] = {
+    "draft": {
+        "crf": 30,
+        "preset": "ultrafast",
+        "maxrate": "",
+        "bufsize": "",
+        "fps": 24,
+        "pix_fmt": "yuv420p",
+        "scale": 0.5,
+    },
+    "shorts": {
+        "crf": 21,
+        "preset": "medium",
+        "maxrate": "8M",
+        "bufsize": "16M",
+        "fps": 30,
+        "pix_fmt": "yuv420p",
+        "scale": 1,
+    },
+    "archive": {
+        "crf": 16,
+        "preset": "slow",
+        "maxrate": "",
+        "bufsize": "",
+        "fps": 0,
+        "pix_fmt": "yuv420p",
+        "scale": 1,
+    },
+}
+
+
+def get_render_profile() -> Tuple[str, dict]:
+    """Reads the render profile chosen in the [settings.render] section
+
+    Returns:
+        Tuple[str, dict]: The name of the profile and its values
+    """
+    render_config = settings.config["settings"]["render"]
+    name = str(render_config["profile"]).strip().lower() or "shorts"
+    if name == "custom":
+        return name, {
+            "crf": int(render_config["crf"]),
+            "preset": render_config["preset"],
+            "maxrate": render_config["maxrate"],
+            "bufsize": render_config["bufsize"],
+            "fps": int(render_config["fps"]),
+            "pix_fmt": render_config["pix_fmt"],
+            "scale": 1,
+        }
+    if name not in RENDER_PROFILES:
+        raise ValueError(
+            f"Unknown render profile {name}. Options are: {', '.join(RENDER_PROFILES)}, custom"
+        )
+    return name, RENDER_PROFILES[name]
+
+
+def video_encode_args(profile: dict) -> dict:
+    """Builds the ffmpeg output arguments of the video stream for a render profile
+
+    Args:
+        profile (dict): The render profile, as returned by get_render_profile
+
+    Returns:
+        dict: Keyword arguments for ffmpeg.output
+    """
+    args = {
+        "c:v": "libx264",
+        "preset": profile["preset"],
+        "crf": profile["crf"],
+        "pix_fmt": profile["pix_fmt"],
+        "threads": multiprocessing.cpu_count(),
+    }
+    if profile["maxrate"]:
+        args["maxrate"] = profile["maxrate"]
+        args["bufsize"] = profile["bufsize"] or profile["maxrate"]
+    if profile["fps"]:
+        args["r"] = profile["fps"]
+    return args
+
+
+def scaled_resolution(profile: dict, W: int, H: int) -> Tuple[int, int]:
+    """Applies the profile's resolution scale, keeping both sides even for yuv420p
+
+    Args:
+        profile (dict): The render profile
+        W (int): The configured width
+        H (int): The configured height
+
+    Returns:
+        Tuple[int, int]: The output width and height
+    """
+    return (
+        max(2, round(W * profile["scale"] / 2) * 2),
+        max(2, round(H * profile["scale"] / 2) * 2),
+    )
@@ -0,0 +1,68 @@
+import json
+import time
+from statistics import median
+from typing import List, Optional
+
+STATS_PATH = "./video_creation/data/render_stats.json"
+MAX_ENTRIES = 100  # only the most recent renders are kept
+
+
+def _load_stats() -> List[dict]:
+    try:
+        with open(STATS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def record_render(
+    profile: str, workers: int, duration: float, seconds: float, frames: int = 0
+) -> None:
+    """Saves how long a render took to video_creation/data/render_stats.json
+
+    Args:
+        profile (str): The render profile
+        workers (int): The number of parallel render workers, 0 for a single ffmpeg process
+        duration (float): Length of the rendered video in seconds
+        seconds (float): Wall clock time the render took
+        frames (int): Number of frames encoded
+    """
+    if duration <= 0 or seconds <= 0:
+        return
+    entries = _load_stats()
+    entries.append(
+        {
+            "time": str(int(time.time())),
+            "profile": profile,
+            "workers": workers,
+            "duration": round(duration, 3),
+            "seconds": round(seconds, 3),
+            "frames": frames,
+        }
+    )
+    with open(STATS_PATH, "w", encoding="utf-8") as f:
+        json.dump(entries[-MAX_ENTRIES:], f, indent=4)
+
+
+def estimate_render_seconds(profile: str, workers: int, duration: float) -> Optional[float]:
+    """Estimates how long a render takes from the throughput of past renders
+
+    Renders with the same profile and number of workers are preferred, then any render with
+    the same profile.
+
+    Args:
+        profile (str): The render profile
+        workers (int): The number of parallel render workers
+        duration (float): Length of the video in seconds
+
+    Returns:
+        Optional[float]: The estimated wall clock seconds, or None without comparable renders
+    """
+    entries = [entry for entry in _load_stats() if entry["profile"] == profile]
+    same_workers = [entry for entry in entries if entry["workers"] == workers]
+    entries = same_workers or entries
+    if not entries:
+        return None
+    # seconds of work per second of video
+    cost = median(entry["seconds"] / entry["duration"] for entry in entries)
+    return cost * duration
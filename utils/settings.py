@@ -1,3 +1,4 @@
+import copy
 import re
 from pathlib import Path
 from typing import Dict, Tuple
@@ -41,17 +42,37 @@ config = {
         "channel_name": "Reddit Tales",
         "tts": {
             "voice_choice": "tiktok",
+            "fallback_providers": "",
+            "hedge_percentile": 95,
             "random_voice": True,
             "elevenlabs_voice_name": "Bella",
             "elevenlabs_api_key": "",
             "aws_polly_voice": "Matthew",
+            "aws_polly_endpoint_url": "",
+            "aws_polly_s3_bucket": "",
             "streamlabs_polly_voice": "Matthew",
             "tiktok_voice": "en_us_001",
             "tiktok_sessionid": "",
             "python_voice": "1",
             "py_voice_num": "2",
             "silence_duration": 0.3,
-            "no_emojis": False
+            "chunk_silence_duration": 0.1,
+            "max_video_length": 50,
+            "no_emojis": False,
+            "max_concurrency": 0,
+            "cache_size_mb": 500
+        },
+        "render": {
+            "single_pass": True,
+            "profile": "shorts",
+            "crf": 21,
+            "preset": "medium",
+            "maxrate": "",
+            "bufsize": "",
+            "fps": 30,
+            "pix_fmt": "yuv420p",
+            "parallel_workers": 0,
+            "dry_run": False
         }
     },
     "ai": {
@@ -59,6 +80,23 @@ config = {
         "ai_similarity_keywords": ""
     }
 }
+# The defaults above, kept for settings a config file leaves unset
+DEFAULTS = copy.deepcopy(config)
+
+
+def get_setting(*keys):
+    """Returns a setting, or its default when the config leaves it unset
+
+    A config written before a setting existed misses it, or holds {} for it once checked.
+
+    Args:
+        *keys: Path of the setting, e.g. "settings", "tts", "max_concurrency"
+    """
+    value, default = config, DEFAULTS
+    for key in keys:
+        value = value.get(key, {}) if isinstance(value, dict) else {}
+        default = default.get(key) if isinstance(default, dict) else None
+    return default if value == {} else value
 
 
 def crawl(obj: dict, func=lambda x, y: print(x, y, end="\n"), path=None):
@@ -75,8 +113,10 @@ def check(value, checks, name):
     def get_check_value(key, default_result):
         return checks[key] if key in checks else default_result
 
-    # Skip validation for all optional fields
+    # Skip validation for all optional fields, the ones left unset get their default
     if "optional" in checks and checks["optional"] is True:
+        if value == {} and "default" in checks:
+            return checks["default"]
         return value
 
     incorrect = False
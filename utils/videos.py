@@ -33,7 +33,14 @@ def check_done(
     return redditobj
 
 
-def save_data(subreddit: str, filename: str, reddit_title: str, reddit_id: str, credit: str):
+def save_data(
+    subreddit: str,
+    filename: str,
+    reddit_title: str,
+    reddit_id: str,
+    credit: str,
+    render_profile: str = "",
+):
     """Saves the videos that have already been generated to a JSON file in video_creation/data/videos.json
 
     Args:
@@ -42,6 +49,7 @@ def save_data(subreddit: str, filename: str, reddit_title: str, reddit_id: str,
         @param filename:
         @param reddit_id:
         @param reddit_title:
+        @param render_profile: The render profile the video was encoded with
     """
     with open("./video_creation/data/videos.json", "r+", encoding="utf-8") as raw_vids:
         done_vids = json.load(raw_vids)
@@ -54,6 +62,7 @@ def save_data(subreddit: str, filename: str, reddit_title: str, reddit_id: str,
             "background_credit": credit,
             "reddit_title": reddit_title,
             "filename": filename,
+            "render_profile": render_profile,
         }
         done_vids.append(payload)
         raw_vids.seek(0)
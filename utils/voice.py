@@ -1,68 +1,165 @@
+import random
 import re
-import sys
+import threading
 import time as pytime
-from datetime import datetime
 from time import sleep
 
+import requests
 from cleantext import clean
 from requests import Response
+from requests.adapters import HTTPAdapter
 
 from utils import settings
 
-if sys.version_info[0] >= 3:
-    from datetime import timezone
 
+def pooled_session(pool_size: int) -> requests.Session:
+    """Creates a session that keeps up to pool_size connections alive, one per concurrent request
 
-def check_ratelimit(response: Response) -> bool:
+    Retries are left to the caller, so they can back off and count towards a circuit breaker.
     """
-    Checks if the response is a ratelimit response.
-    If it is, it sleeps for the time specified in the response.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30) -> float:
+    """Returns how long to wait before retry number attempt (starting at 0)
+
+    Exponential backoff with full jitter, so concurrent clients don't retry in lockstep.
     """
-    if response.status_code == 429:
-        try:
-            time = int(response.headers["X-RateLimit-Reset"])
-            print(f"Ratelimit hit. Sleeping for {time - int(pytime.time())} seconds.")
-            sleep_until(time)
-            return False
-        except KeyError:  # if the header is not present, we don't know how long to wait
-            return False
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def retry_after(response: Response) -> float:
+    """Returns the seconds a 429/503 response asks to wait for, 0 if it doesn't say"""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", 0)))
+    except ValueError:  # an HTTP date instead of seconds
+        return 0.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while the endpoint is considered down"""
 
-    return True
 
+class CircuitBreaker:
+    """Fails calls at once while an endpoint is down
 
-def sleep_until(time) -> None:
+    A call counts as failed once it has used up all of its retries. After failure_threshold
+    consecutive failed calls the circuit opens and every call raises CircuitOpenError straight
+    away, so the caller can move on to another provider. Once reset_timeout seconds have passed a
+    single trial call is let through, which closes the circuit again if it succeeds. Calls made
+    while the trial call runs may wait a bounded time for its outcome.
+
+    Args:
+        name (str): Name of the endpoint, for error messages
+        failure_threshold (Optional): Consecutive failed calls that open the circuit
+        reset_timeout (Optional): Seconds until a trial call is let through
     """
-    Pause your program until a specific end time.
-    'time' is either a valid datetime object or unix timestamp in seconds (i.e. seconds since Unix epoch)
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._changed = threading.Condition()
+
+    def before_call(self, wait: float = 0) -> bool:
+        """Raises CircuitOpenError if the call must not be made
+
+        The caller must report the outcome of the call with record_success or record_failure,
+        whatever exception it ends in.
+
+        Args:
+            wait (Optional): Seconds to wait for a running trial call to succeed before failing
+
+        Returns:
+            bool: Whether this is the trial call, which has to report its outcome with trial=True
+        """
+        deadline = pytime.monotonic() + wait
+        with self._changed:
+            while self._opened_at is not None:
+                if self._opened_at + self.reset_timeout > pytime.monotonic():
+                    break
+                if not self._trial_running:
+                    self._trial_running = True
+                    return True
+                remaining = deadline - pytime.monotonic()
+                if remaining <= 0:
+                    break
+                # woken up when the trial call finishes
+                self._changed.wait(remaining)
+            else:
+                return False
+            raise CircuitOpenError(
+                f"{self.name} failed {self._failures} times in a row, not trying again for now"
+            )
+
+    def record_success(self, trial: bool = False) -> None:
+        with self._changed:
+            self._failures = 0
+            self._opened_at = None
+            if trial:
+                self._trial_running = False
+            self._changed.notify_all()
+
+    def record_failure(self, trial: bool = False) -> None:
+        with self._changed:
+            self._failures += 1
+            if trial:
+                self._trial_running = False
+                self._opened_at = pytime.monotonic()
+            elif self._opened_at is None and self._failures >= self.failure_threshold:
+                self._opened_at = pytime.monotonic()
+            self._changed.notify_all()
+
+
+class TokenBucket:
+    """Spaces out requests to an endpoint, shared by every thread that calls it
+
+    Tokens are added at rate per second up to capacity, every request takes one. When the
+    endpoint reports a rate limit, pause_until() holds back all callers until it resets.
+
+    Args:
+        rate (float): Requests per second in the long run
+        capacity (int): Requests that may be made in a burst
     """
-    end = time
-
-    # Convert datetime to unix timestamp and adjust for locality
-    if isinstance(time, datetime):
-        # If we're on Python 3 and the user specified a timezone, convert to UTC and get the timestamp.
-        if sys.version_info[0] >= 3 and time.tzinfo:
-            end = time.astimezone(timezone.utc).timestamp()
-        else:
-            zoneDiff = pytime.time() - (datetime.now() - datetime(1970, 1, 1)).total_seconds()
-            end = (time - datetime(1970, 1, 1)).total_seconds() + zoneDiff
-
-    # Type check
-    if not isinstance(end, (int, float)):
-        raise Exception("The time parameter is not a number or datetime object")
-
-    # Now we wait
-    while True:
-        now = pytime.time()
-        diff = end - now
-
-        #
-        # Time is up!
-        #
-        if diff <= 0:
-            break
-        else:
-            # 'logarithmic' sleeping to minimize loop iterations
-            sleep(diff / 2)
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = pytime.time()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a request may be made"""
+        while True:
+            with self._lock:
+                now = pytime.time()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+    def pause_until(self, timestamp: float) -> None:
+        """Holds back every request until the given unix timestamp"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, timestamp)
+            self._tokens = 0
 
 
 def sanitize_text(text: str) -> str:
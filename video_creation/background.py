@@ -1,15 +1,19 @@
 import json
+import os
 import random
 import re
+from os.path import exists
 from pathlib import Path
 from random import randrange
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
 
+import ffmpeg
 import yt_dlp
-from moviepy.editor import AudioFileClip, VideoFileClip
+from moviepy.editor import VideoFileClip
 from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
 
 from utils import settings
+from utils.audio import audio_duration
 from utils.console import print_step, print_substep
 
 # Load background options at module level
@@ -202,9 +206,8 @@ def download_background_audio(background_config: Tuple[str, str, str]):
     if Path(output_path).is_file():
         try:
             # Verify the file is a valid audio file
-            with AudioFileClip(output_path) as clip:
-                if clip.duration > 0:
-                    return
+            if audio_duration(output_path) > 0:
+                return
         except Exception:
             # If file is invalid, remove it and download again
             Path(output_path).unlink()
@@ -267,9 +270,8 @@ def download_background_audio(background_config: Tuple[str, str, str]):
             raise Exception("Download completed but file not found")
             
         # Verify the file is a valid audio file
-        with AudioFileClip(output_path) as clip:
-            if clip.duration <= 0:
-                raise Exception("Downloaded file is not a valid audio file")
+        if audio_duration(output_path) <= 0:
+            raise Exception("Downloaded file is not a valid audio file")
                 
         print_substep("Background audio downloaded successfully! 🎉", style="bold green")
     except Exception as e:
@@ -283,47 +285,108 @@ def download_background_audio(background_config: Tuple[str, str, str]):
         raise Exception(error_msg)
 
 
+def load_background_cut(reddit_id: str) -> dict:
+    """Returns where chop_background cut the background of a thread, {} if it hasn't yet
+
+    Returns:
+        dict: For "audio" and "video", the source file, its size and modification time and the
+        start and end of the cut
+    """
+    try:
+        with open(f"assets/temp/{reddit_id}/background.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _pick_spot(
+    previous: Optional[dict], source: str, video_length: int, length: Callable[[], float]
+) -> dict:
+    """Returns the spot an earlier run cut out of source if it still fits, otherwise a new one
+
+    Args:
+        previous (Optional[dict]): The cut of the earlier run, see load_background_cut
+        source (str): The background file
+        video_length (int): Length of the video
+        length (Callable[[], float]): Returns the length of the source, only called for a new spot
+    """
+    stat = os.stat(source)
+    spot = {"source": source, "file": [stat.st_size, stat.st_mtime_ns]}
+    if (
+        previous
+        and all(previous.get(key) == value for key, value in spot.items())
+        and previous["end"] - previous["start"] == video_length
+    ):
+        return previous
+    spot["start"], spot["end"] = get_start_and_end_times(video_length, length())
+    return spot
+
+
 def chop_background(background_config: Dict[str, Tuple], video_length: int, reddit_object: dict):
     """Generates the background audio and footage to be used in the video and writes it to assets/temp/background.mp3 and assets/temp/background.mp4
 
+    The spots are recorded in assets/temp/{id}/background.json. A restarted run of the same
+    thread cuts the same spots, so the chunks an interrupted render left behind are reused, and
+    finds the cut files still in place.
+
     Args:
         background_config (Dict[str,Tuple]]) : Current background configuration
         video_length (int): Length of the clip where the background footage is to be taken out of
     """
     id = re.sub(r"[^\w\s-]", "", reddit_object["thread_id"])
+    previous = load_background_cut(id)
+    cut = {}
 
     if settings.config["settings"]["background"][f"background_audio_volume"] == 0:
         print_step("Volume was set to 0. Skipping background audio creation . . .")
     else:
         print_step("Finding a spot in the backgrounds audio to chop...✂️")
         audio_choice = f"{background_config['audio'][2]}-{background_config['audio'][1]}"
-        background_audio = AudioFileClip(f"assets/backgrounds/audio/{audio_choice}")
-        start_time_audio, end_time_audio = get_start_and_end_times(
-            video_length, background_audio.duration
+        audio_path = f"assets/backgrounds/audio/{audio_choice}"
+        # the length is read from the file headers, only the chosen spot is decoded
+        cut["audio"] = _pick_spot(
+            previous.get("audio"), audio_path, video_length, lambda: audio_duration(audio_path)
         )
-        background_audio = background_audio.subclip(start_time_audio, end_time_audio)
-        background_audio.write_audiofile(f"assets/temp/{id}/background.mp3")
+        output_path = f"assets/temp/{id}/background.mp3"
+        if cut["audio"] is not previous.get("audio") or not exists(output_path):
+            start_time_audio, end_time_audio = cut["audio"]["start"], cut["audio"]["end"]
+            ffmpeg.input(
+                audio_path, ss=start_time_audio, t=end_time_audio - start_time_audio
+            ).output(
+                output_path, f="mp3", acodec="libmp3lame", **{"q:a": 2}
+            ).overwrite_output().run(quiet=True)
 
     print_step("Finding a spot in the backgrounds video to chop...✂️")
     video_choice = f"{background_config['video'][2]}-{background_config['video'][1]}"
-    background_video = VideoFileClip(f"assets/backgrounds/video/{video_choice}")
-    start_time_video, end_time_video = get_start_and_end_times(
-        video_length, background_video.duration
-    )
-    # Extract video subclip
-    try:
-        ffmpeg_extract_subclip(
-            f"assets/backgrounds/video/{video_choice}",
-            start_time_video,
-            end_time_video,
-            targetname=f"assets/temp/{id}/background.mp4",
-        )
-    except (OSError, IOError):  # ffmpeg issue see #348
-        print_substep("FFMPEG issue. Trying again...")
-        with VideoFileClip(f"assets/backgrounds/video/{video_choice}") as video:
-            new = video.subclip(start_time_video, end_time_video)
-            new.write_videofile(f"assets/temp/{id}/background.mp4")
-    print_substep("Background video chopped successfully!", style="bold green")
+    video_path = f"assets/backgrounds/video/{video_choice}"
+
+    def video_duration():
+        with VideoFileClip(video_path) as video:
+            return video.duration
+
+    cut["video"] = _pick_spot(previous.get("video"), video_path, video_length, video_duration)
+    output_path = f"assets/temp/{id}/background.mp4"
+    if cut["video"] is previous.get("video") and exists(output_path):
+        print_substep("Reusing the background video chopped by the last run", style="bold green")
+    else:
+        start_time_video, end_time_video = cut["video"]["start"], cut["video"]["end"]
+        # Extract video subclip
+        try:
+            ffmpeg_extract_subclip(
+                video_path,
+                start_time_video,
+                end_time_video,
+                targetname=output_path,
+            )
+        except (OSError, IOError):  # ffmpeg issue see #348
+            print_substep("FFMPEG issue. Trying again...")
+            with VideoFileClip(video_path) as video:
+                new = video.subclip(start_time_video, end_time_video)
+                new.write_videofile(output_path)
+        print_substep("Background video chopped successfully!", style="bold green")
+
+    with open(f"assets/temp/{id}/background.json", "w", encoding="utf-8") as f:
+        json.dump(cut, f, indent=4)
     return background_config["video"][2]
 
 
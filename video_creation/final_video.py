@@ -1,70 +1,148 @@
+import hashlib
+import json
 import multiprocessing
 import os
 import re
-import tempfile
+import shutil
 import textwrap
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from os.path import exists  # Needs to be imported specifically
 from pathlib import Path
-from typing import Dict, Final, Tuple
+from typing import Dict, Final, List, NamedTuple, Optional, Tuple
 
 import ffmpeg
 import translators
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from rich.console import Console
 from rich.progress import track
 
 from utils import settings
 from utils.cleanup import cleanup
+from utils.audio import assemble_audio, audio_duration
 from utils.console import print_step, print_substep
-from utils.fonts import getheight
+from utils.fonts import get_font, get_image, getheight
+from utils.imagenarator import fit_overlay, overlay_width
+from utils.manifest import load_manifest, manifest_duration
+from utils.render_profiles import get_render_profile, scaled_resolution, video_encode_args
+from utils.render_stats import estimate_render_seconds, record_render
 from utils.thumbnail import create_thumbnail
 from utils.videos import save_data
+from video_creation.background import load_background_cut
 
 console = Console()
 
 
+class FfmpegProgress(NamedTuple):
+    """One block of ffmpeg's -progress output"""
+
+    frame: int
+    fps: float
+    bitrate: str
+    total_size: int
+    out_time: Optional[float]  # seconds of output written so far
+    speed: Optional[float]  # encode speed as a multiple of realtime
+    done: bool
+
+    @classmethod
+    def parse(cls, block: Dict[str, str]) -> "FfmpegProgress":
+        def number(key: str, cast=float, default=0):
+            try:
+                return cast(block.get(key, "").rstrip("x"))
+            except ValueError:  # ffmpeg writes N/A until it knows the value
+                return default
+
+        # out_time_ms is in microseconds as well, it is kept for older ffmpeg builds
+        out_time_us = number("out_time_us", int, None)
+        if out_time_us is None:
+            out_time_us = number("out_time_ms", int, None)
+        return cls(
+            frame=number("frame", int),
+            fps=number("fps"),
+            bitrate=block.get("bitrate", "N/A"),
+            total_size=number("total_size", int),
+            out_time=out_time_us / 1000000.0 if out_time_us is not None else None,
+            speed=number("speed", float, None),
+            done=block.get("progress") == "end",
+        )
+
+
 class ProgressFfmpeg(threading.Thread):
-    def __init__(self, vid_duration_seconds, progress_update_callback):
-        threading.Thread.__init__(self, name="ProgressFfmpeg")
-        self.stop_event = threading.Event()
-        self.output_file = tempfile.NamedTemporaryFile(mode="w+", delete=False)
+    """Follows the -progress stream of a running ffmpeg and reports every update as it arrives
+    Args:
+        progress_stream: The pipe ffmpeg writes its progress to
+        vid_duration_seconds (float): Length of the output, to turn progress into a fraction
+        progress_update_callback: Called with the completed fraction of the output
+        event_callback (Optional): Called with every FfmpegProgress
+    """
+
+    def __init__(
+        self, progress_stream, vid_duration_seconds, progress_update_callback, event_callback=None
+    ):
+        threading.Thread.__init__(self, name="ProgressFfmpeg", daemon=True)
+        self.progress_stream = progress_stream
         self.vid_duration_seconds = vid_duration_seconds
         self.progress_update_callback = progress_update_callback
+        self.event_callback = event_callback
+        self.latest: Optional[FfmpegProgress] = None
 
     def run(self):
-        while not self.stop_event.is_set():
-            latest_progress = self.get_latest_ms_progress()
-            if latest_progress is not None:
-                completed_percent = latest_progress / self.vid_duration_seconds
-                self.progress_update_callback(completed_percent)
-            time.sleep(1)
-
-    def get_latest_ms_progress(self):
-        lines = self.output_file.readlines()
-
-        if lines:
-            for line in lines:
-                if "out_time_ms" in line:
-                    out_time_ms_str = line.split("=")[1].strip()
-                    if out_time_ms_str.isnumeric():
-                        return float(out_time_ms_str) / 1000000.0
-                    else:
-                        # Handle the case when "N/A" is encountered
-                        return None
-        return None
-
-    def stop(self):
-        self.stop_event.set()
+        block = {}
+        for line in self.progress_stream:
+            key, _, value = line.decode("utf8", "replace").strip().partition("=")
+            block[key] = value
+            # every block of key=value lines is closed by progress=continue or progress=end
+            if key != "progress":
+                continue
+            event = FfmpegProgress.parse(block)
+            block = {}
+            self.latest = event
+            if event.out_time is not None and self.vid_duration_seconds:
+                self.progress_update_callback(
+                    min(event.out_time / self.vid_duration_seconds, 1.0)
+                )
+            if self.event_callback is not None:
+                self.event_callback(event)
+        self.progress_stream.close()
 
     def __enter__(self):
         self.start()
         return self
 
     def __exit__(self, *args, **kwargs):
-        self.stop()
+        self.join()
+
+
+def run_ffmpeg(
+    output, vid_duration_seconds, progress_update_callback, event_callback=None
+) -> Optional[FfmpegProgress]:
+    """Runs an ffmpeg output while following its progress through a pipe
+    Args:
+        output (ffmpeg): The ffmpeg output to run
+        vid_duration_seconds (float): Length of the output
+        progress_update_callback: Called with the completed fraction of the output
+        event_callback (Optional): Called with every FfmpegProgress
+    Returns:
+        Optional[FfmpegProgress]: The last progress report, with the final fps and speed
+    Raises:
+        ffmpeg.Error: If ffmpeg exits with an error
+    """
+    process = (
+        output.overwrite_output()
+        .global_args("-progress", "pipe:1", "-nostats")
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    with ProgressFfmpeg(
+        process.stdout, vid_duration_seconds, progress_update_callback, event_callback
+    ) as progress:
+        # stderr is drained here while the progress thread drains stdout, so neither pipe fills up
+        stderr = process.stderr.read()
+        process.stderr.close()
+    if process.wait() != 0:
+        raise ffmpeg.Error("ffmpeg", None, stderr)
+    return progress.latest
 
 
 def name_normalize(name: str) -> str:
@@ -91,24 +169,39 @@ def name_normalize(name: str) -> str:
         return name
 
 
-def prepare_background(reddit_id: str, W: int, H: int) -> str:
-    output_path = f"assets/temp/{reddit_id}/background_noaudio.mp4"
-    output = (
-        ffmpeg.input(f"assets/temp/{reddit_id}/background.mp4")
+def background_stream(reddit_id: str, W: int, H: int, **input_args):
+    """Scales and crops the chopped background footage to the output resolution
+    Args:
+        reddit_id (str): The ID of subreddit
+        W (int): Output width
+        H (int): Output height
+        **input_args: Extra ffmpeg input options, e.g. ss and t to read only a part of it
+    Returns:
+        The ffmpeg video stream of the background, ready to be overlaid
+    """
+    return (
+        ffmpeg.input(f"assets/temp/{reddit_id}/background.mp4", **input_args)["v"]
         .filter("scale", W, H, force_original_aspect_ratio="increase")
         .filter("crop", W, H)
+    )
+
+
+def prepare_background(
+    reddit_id: str, W: int, H: int, profile: dict, planned: Optional[list] = None
+) -> str:
+    output_path = f"assets/temp/{reddit_id}/background_noaudio.mp4"
+    output = (
+        background_stream(reddit_id, W, H)
         .output(
             output_path,
             an=None,
-            **{
-                "c:v": "h264",
-                "b:v": "20M",
-                "b:a": "192k",
-                "threads": multiprocessing.cpu_count(),
-            },
+            **video_encode_args(profile),
         )
         .overwrite_output()
     )
+    if planned is not None:  # dry run
+        planned.append(output)
+        return output_path
     try:
         output.run(quiet=True)
     except ffmpeg.Error as e:
@@ -117,10 +210,23 @@ def prepare_background(reddit_id: str, W: int, H: int) -> str:
     return output_path
 
 
+def tee_output(path: str, streams: str) -> str:
+    """Builds one output entry for ffmpeg's tee muxer
+    Args:
+        path (str): The mp4 file to write
+        streams (str): Stream specifiers of the streams that go into this file, e.g. "v:0,a:1"
+    Returns:
+        str: The escaped tee entry
+    """
+    # Characters the tee muxer treats as syntax have to be backslash escaped in the filename
+    escaped_path = re.sub(r"([\\'|\[\]])", r"\\\1", path)
+    return f"[f=mp4:select=\\'{streams}\\']{escaped_path}"
+
+
 def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     print_step(f"Creating fancy thumbnail for: {text}")
     font_title_size = 47
-    font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
+    font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
     image_width, image_height = image.size
     lines = textwrap.wrap(text, width=wrap)
     y = (
@@ -130,7 +236,7 @@ def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     )
     draw = ImageDraw.Draw(image)
 
-    username_font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), 30)
+    username_font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), 30)
     draw.text(
         (205, 825),
         settings.config["settings"]["channel_name"],
@@ -142,7 +248,7 @@ def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     if len(lines) == 3:
         lines = textwrap.wrap(text, width=wrap + 10)
         font_title_size = 40
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
+        font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
         y = (
             (image_height / 2)
             - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2)
@@ -151,7 +257,7 @@ def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     elif len(lines) == 4:
         lines = textwrap.wrap(text, width=wrap + 10)
         font_title_size = 35
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
+        font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
         y = (
             (image_height / 2)
             - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2)
@@ -160,7 +266,7 @@ def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     elif len(lines) > 4:
         lines = textwrap.wrap(text, width=wrap + 10)
         font_title_size = 30
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
+        font = get_font(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
         y = (
             (image_height / 2)
             - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2)
@@ -174,32 +280,354 @@ def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     return image
 
 
-def merge_background_audio(audio: ffmpeg, reddit_id: str):
-    """Gather an audio and merge with assets/backgrounds/background.mp3
+def build_image_timeline(reddit_id: str, segments: List[Tuple[str, float]]) -> str:
+    """Assembles the per-segment images into one timed image stream, written as an ffconcat file
+    The images are already stored at their on-screen size and opacity, so they are only centred
+    on a transparent canvas shared by all segments, which gives ffmpeg a fixed frame size.
+    A blank canvas follows the last segment, which keeps the ending free of overlays.
+    Args:
+        reddit_id (str): The ID of subreddit
+        segments (List[Tuple[str, float]]): (image path, seconds on screen) in order
+    Returns:
+        str: Path to the ffconcat file
+    """
+    timeline_path = f"assets/temp/{reddit_id}/png/timeline"
+    Path(timeline_path).mkdir(parents=True, exist_ok=True)
+
+    frames = [
+        Image.open(image_path).convert("RGBA")
+        for image_path, _ in track(segments, "Building the image timeline...")
+    ]
+
+    canvas_size = (max(frame.width for frame in frames), max(frame.height for frame in frames))
+    lines = ["ffconcat version 1.0"]
+    for i, (frame, (_, duration)) in enumerate(zip(frames, segments)):
+        canvas = Image.new("RGBA", canvas_size, (0, 0, 0, 0))
+        canvas.paste(
+            frame,
+            ((canvas_size[0] - frame.width) // 2, (canvas_size[1] - frame.height) // 2),
+        )
+        canvas.save(f"{timeline_path}/{i}.png")
+        lines.append(f"file '{i}.png'")
+        lines.append(f"duration {duration:.6f}")
+    # the overlay holds the last frame of the stream until the video ends
+    Image.new("RGBA", canvas_size, (0, 0, 0, 0)).save(f"{timeline_path}/blank.png")
+    lines.append("file 'blank.png'")
+
+    with open(f"{timeline_path}/timeline.ffconcat", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return f"{timeline_path}/timeline.ffconcat"
+
+
+def decorate_video(
+    clip, credit: str, W: int, H: int, profile: dict, rescale: bool, time_offset: float = 0
+):
+    """Draws the background credit and the progress bar, and applies the profile's output size
+    Args:
+        clip (ffmpeg): The background video with the images overlaid
+        credit (str): The author of the background footage
+        W (int): The configured width
+        H (int): The configured height
+        profile (dict): The render profile
+        rescale (bool): Whether the stream has to be scaled to the output size
+        time_offset (float): Where the clip starts in the final video, for the progress bar
+    Returns:
+        The decorated ffmpeg video stream
+    """
+    text = f"Background by {credit}"
+    clip = ffmpeg.drawtext(
+        clip,
+        text=text,
+        x=f"(w-text_w)",
+        y=f"(h-text_h)",
+        fontsize=5,
+        fontcolor="White",
+        fontfile=os.path.join("fonts", "Roboto-Regular.ttf"),
+    )
+
+    # Add progress bar
+    # First draw the background bar
+    clip = ffmpeg.drawbox(
+        clip,
+        x="0",
+        y="(h-10)",  # 10 pixels from bottom
+        width="iw",  # Use input width
+        height="5",  # 5 pixels height
+        color="black@0.5",  # Semi-transparent black
+        t="fill",
+    )
+
+    # Then draw the progress bar that fills up
+    clip = ffmpeg.drawbox(
+        clip,
+        x="0",
+        y="(h-10)",  # 10 pixels from bottom
+        # Dynamic width based on current time (67 seconds total)
+        width=f"(iw*(t+{time_offset})/67)" if time_offset else "(iw*t/67)",
+        height="5",  # 5 pixels height
+        color="white@0.8",  # Semi-transparent white
+        t="fill",
+    )
+
+    if rescale:
+        clip = clip.filter("scale", *scaled_resolution(profile, W, H))
+    return clip
+
+
+def get_frame_rate(profile: dict, video_path: str) -> float:
+    """Returns the frame rate the video is rendered at: the profile's, or else the source's"""
+    if profile["fps"]:
+        return float(profile["fps"])
+    for stream in ffmpeg.probe(video_path)["streams"]:
+        if stream["codec_type"] == "video":
+            numerator, denominator = stream["r_frame_rate"].split("/")
+            return float(numerator) / float(denominator)
+    return 30.0
+
+
+def file_fingerprint(path: str, hash_content: bool = False):
+    """Returns what identifies the content of a file, None if it doesn't exist
+
+    Args:
+        path (str): The file
+        hash_content (bool): Hash the file instead of taking its size and modification time, for
+            small files that are rewritten with the same content on every run
+    """
+    try:
+        if hash_content:
+            with open(path, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def render_segments_parallel(
+    reddit_id: str,
+    segments: List[Tuple[str, float]],
+    length: int,
+    W: int,
+    H: int,
+    profile: dict,
+    single_pass: bool,
+    credit: str,
+    workers: int,
+    planned: Optional[list] = None,
+):
+    """Renders every segment of the video as its own chunk, several at a time, and joins them
+    Chunks are cut on frame boundaries, encoded with closed GOPs and stitched with the concat
+    demuxer, so joining them is a stream copy. Finished chunks are kept in
+    assets/temp/{reddit_id}/chunks and reused when an interrupted render is restarted.
     Args:
-        audio (ffmpeg): The TTS final audio but without background.
         reddit_id (str): The ID of subreddit
+        segments (List[Tuple[str, float]]): (image path, seconds on screen) in order
+        length (int): Length of the video
+        W (int): The configured width
+        H (int): The configured height
+        profile (dict): The render profile
+        single_pass (bool): Whether the background is scaled inside the chunk graphs
+        credit (str): The author of the background footage
+        workers (int): How many chunks are encoded at the same time
+        planned (Optional[list]): For a dry run, the chunk outputs are added here instead of run
+    Returns:
+        The ffmpeg video stream of the joined chunks
     """
+    chunks_path = f"assets/temp/{reddit_id}/chunks"
+    timeline_path = f"assets/temp/{reddit_id}/png/timeline"
+    source = (
+        f"assets/temp/{reddit_id}/background.mp4"
+        if single_pass
+        else f"assets/temp/{reddit_id}/background_noaudio.mp4"
+    )
+    # the pre-rendered background keeps the frame rate of background.mp4, which exists in dry runs too
+    fps = get_frame_rate(profile, f"assets/temp/{reddit_id}/background.mp4")
+
+    # Chunk boundaries in frames: one chunk per segment, then the ending up to the full length
+    boundaries = [0]
+    elapsed = 0
+    for _, duration in segments:
+        elapsed += duration
+        boundaries.append(round(elapsed * fps))
+    boundaries.append(max(round(length * fps), boundaries[-1] + 1))
+
+    chunks = []
+    for i in range(len(boundaries) - 1):
+        image = f"{timeline_path}/{i}.png" if i < len(segments) else None
+        chunks.append(
+            {
+                "start": boundaries[i],
+                "frames": boundaries[i + 1] - boundaries[i],
+                "image": image,
+            }
+        )
+    chunks = [chunk for chunk in chunks if chunk["frames"] > 0]
+
+    rescale = not single_pass or profile["scale"] != 1
+    chunk_args = {
+        **video_encode_args(profile),
+        "r": fps,
+        "flags": "+cgop",
+        "threads": max(1, multiprocessing.cpu_count() // workers),
+    }
+
+    def chunk_output(i: int):
+        chunk = chunks[i]
+        start = chunk["start"] / fps
+        if single_pass:
+            clip = background_stream(
+                reddit_id, W, H, ss=start, t=chunk["frames"] / fps + 1
+            )
+        else:
+            clip = ffmpeg.input(source, ss=start, t=chunk["frames"] / fps + 1)["v"]
+        if chunk["image"]:
+            clip = clip.overlay(
+                ffmpeg.input(chunk["image"])["v"],
+                x="(main_w-overlay_w)/2",
+                y="(main_h-overlay_h)/2",
+            )
+        clip = decorate_video(clip, credit, W, H, profile, rescale, time_offset=start)
+        # written under a temporary name, so only complete chunks are ever reused
+        return ffmpeg.output(
+            clip,
+            f"{chunks_path}/{i:04d}.part.mp4",
+            f="mp4",
+            an=None,
+            **{"frames:v": chunk["frames"]},
+            **chunk_args,
+        ).overwrite_output()
+
+    if planned is not None:  # dry run
+        planned.extend(chunk_output(i) for i in range(len(chunks)))
+        return ffmpeg.input(f"{chunks_path}/chunks.ffconcat", f="concat", safe=0)["v"]
+
+    # Chunks left over from an interrupted render are only reused if they belong to the same plan,
+    # rendered from the same spot of the same footage. The background is identified by where
+    # chop_background cut it, as the pre-rendered background is written again on every run.
+    plan = {
+        "fps": fps,
+        "W": W,
+        "H": H,
+        "profile": profile,
+        "source": source,
+        "chunks": chunks,
+        "credit": credit,
+        "background": load_background_cut(reddit_id).get("video")
+        or file_fingerprint(f"assets/temp/{reddit_id}/background.mp4"),
+        # the timeline images are written again on every run
+        "images": [file_fingerprint(chunk["image"], True) for chunk in chunks if chunk["image"]],
+    }
+    Path(chunks_path).mkdir(parents=True, exist_ok=True)
+    plan_file = f"{chunks_path}/plan.json"
+    if exists(plan_file):
+        with open(plan_file, encoding="utf-8") as f:
+            if json.load(f) != json.loads(json.dumps(plan)):
+                shutil.rmtree(chunks_path)
+                Path(chunks_path).mkdir(parents=True)
+    with open(plan_file, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=4)
+
+    def render_chunk(i: int) -> None:
+        chunk_file = f"{chunks_path}/{i:04d}.mp4"
+        if exists(chunk_file):
+            return
+        chunk_output(i).run(quiet=True)
+        os.replace(f"{chunks_path}/{i:04d}.part.mp4", chunk_file)
+
+    done = sum(exists(f"{chunks_path}/{i:04d}.mp4") for i in range(len(chunks)))
+    if done:
+        print_substep(f"Resuming the render, {done} of {len(chunks)} chunks are already done")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in track(
+                executor.map(render_chunk, range(len(chunks))),
+                "Rendering chunks...",
+                total=len(chunks),
+            ):
+                pass
+    except ffmpeg.Error as e:
+        print(e.stderr.decode("utf8"))
+        exit(1)
+
+    with open(f"{chunks_path}/chunks.ffconcat", "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for i in range(len(chunks)):
+            f.write(f"file '{i:04d}.mp4'\n")
+    return ffmpeg.input(f"{chunks_path}/chunks.ffconcat", f="concat", safe=0)["v"]
+
+
+def background_audio_volume() -> float:
+    """Reads the volume the background audio is mixed in at, 0 meaning no background audio"""
     background_audio_volume = settings.config["settings"]["background"]["background_audio_volume"]
     if background_audio_volume == 0:
-        return audio  # Return the original audio
-    else:
-        # Ensure volume is a valid float
-        try:
-            volume = float(background_audio_volume)
-            if volume < 0 or volume > 1:
-                volume = 0.15  # Default to 0.15 if out of range
-        except (ValueError, TypeError):
-            volume = 0.15  # Default to 0.15 if invalid
-            
-        # sets volume to config
-        bg_audio = ffmpeg.input(f"assets/temp/{reddit_id}/background.mp3").filter(
-            "volume",
-            volume,
+        return 0
+    # Ensure volume is a valid float
+    try:
+        volume = float(background_audio_volume)
+        if volume < 0 or volume > 1:
+            volume = 0.15  # Default to 0.15 if out of range
+    except (ValueError, TypeError):
+        volume = 0.15  # Default to 0.15 if invalid
+    return volume
+
+
+def export_render_plan(
+    plan_path: str,
+    outputs: list,
+    length: float,
+    profile_name: str,
+    parallel_workers: int,
+    video_path: str,
+) -> dict:
+    """Writes the ffmpeg commands of a render to a JSON file without running them, with an
+    estimate of how long they take based on past renders
+    Args:
+        plan_path (str): Where to save the plan
+        outputs (list): The ffmpeg outputs of the render, in the order they are run
+        length (float): Length of the video
+        profile_name (str): The render profile
+        parallel_workers (int): The number of parallel render workers
+        video_path (str): The video the render would create
+    Returns:
+        dict: The plan
+    """
+    workers = parallel_workers if parallel_workers > 1 else 0
+    commands = []
+    for output in outputs:
+        args = ffmpeg.compile(output)
+        # every filter is its own ;-separated entry of the filter graph ffmpeg-python builds
+        filter_graph = args[args.index("-filter_complex") + 1] if "-filter_complex" in args else ""
+        commands.append(
+            {
+                "inputs": args.count("-i"),
+                "filters": len(filter_graph.split(";")) if filter_graph else 0,
+                "args": args,
+            }
         )
-        # Merges audio and background_audio
-        merged_audio = ffmpeg.filter([audio, bg_audio], "amix", duration="longest")
-        return merged_audio  # Return merged audio
+    estimate = estimate_render_seconds(profile_name, workers, length)
+    plan = {
+        "video": video_path,
+        "duration": round(length, 3),
+        "profile": profile_name,
+        "parallel_workers": workers,
+        "inputs": sum(command["inputs"] for command in commands),
+        "filters": sum(command["filters"] for command in commands),
+        "estimated_seconds": round(estimate, 1) if estimate is not None else None,
+        "commands": commands,
+    }
+    with open(plan_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=4)
+
+    print_substep(
+        f"{len(commands)} ffmpeg command(s) with {plan['inputs']} inputs and "
+        f"{plan['filters']} filters for {length:.2f} seconds of video"
+    )
+    if estimate is None:
+        print_substep("No past renders with this profile to estimate the encode time from")
+    else:
+        print_substep(f"Estimated encode time: {estimate:.0f} seconds")
+    print_substep(f"Render plan saved to {plan_path}", style="bold green")
+    return plan
 
 
 def make_final_video(
@@ -215,12 +643,11 @@ def make_final_video(
         reddit_obj (dict): The reddit object that contains the posts to read.
         background_config (Tuple[str, str, str, Any]): The background config to use.
     Returns:
-        str: Path to the created video file
+        str: Path to the created video file, or to the render plan in a dry run
     """
     # settings values
     W: Final[int] = int(settings.config["settings"]["resolution_w"])
     H: Final[int] = int(settings.config["settings"]["resolution_h"])
-    opacity = settings.config["settings"]["opacity"]
     settingsbackground = settings.config["settings"]["background"]
 
     reddit_id = re.sub(r"[^\w\s-]", "", reddit_obj["thread_id"])
@@ -265,7 +692,23 @@ def make_final_video(
             print_substep("Creating thumbnails folder")
             os.makedirs(thumbnails_path)
 
-    background_clip = ffmpeg.input(prepare_background(reddit_id, W=W, H=H))
+    profile_name, profile = get_render_profile()
+    print_substep(f"Using the {profile_name} render profile")
+    single_pass: bool = settings.config["settings"]["render"]["single_pass"]
+    parallel_workers = int(settings.config["settings"]["render"]["parallel_workers"])
+    dry_run: bool = settings.config["settings"]["render"]["dry_run"]
+    # In a dry run every ffmpeg output is collected here instead of being run
+    planned = [] if dry_run else None
+    render_seconds = 0.0
+    if single_pass:
+        # Scale/crop happen inside the final graph, so the footage is only encoded once
+        background_clip = background_stream(reddit_id, W=W, H=H)
+    else:
+        started = time.monotonic()
+        background_clip = ffmpeg.input(
+            prepare_background(reddit_id, W=W, H=H, profile=profile, planned=planned)
+        )
+        render_seconds += time.monotonic() - started
 
     # Gather all audio clips
     audio_clips = list()
@@ -275,110 +718,96 @@ def make_final_video(
         )
         exit()
     
-    # Function to verify audio file exists and has content
-    def verify_audio_file(file_path: str) -> bool:
+    # Durations measured by the TTS stage, so the clips don't have to be probed again
+    manifest = load_manifest(reddit_id)
+
+    # Function to verify audio file exists and has content, returns its duration
+    def verify_audio_file(file_path: str) -> Optional[float]:
         if not os.path.exists(file_path):
             print(f"Error: Audio file not found: {file_path}")
-            return False
+            return None
         try:
-            probe = ffmpeg.probe(file_path)
-            if float(probe["format"]["duration"]) <= 0:
+            duration = manifest_duration(manifest, file_path)
+            if duration is None:
+                duration = audio_duration(file_path)
+            if duration <= 0:
                 print(f"Error: Audio file has no content: {file_path}")
-                return False
-            return True
+                return None
+            return duration
         except Exception as e:
             print(f"Error verifying audio file {file_path}: {str(e)}")
-            return False
+            return None
 
     # Add title audio
     title_audio = f"assets/temp/{reddit_id}/mp3/title.mp3"
-    if not verify_audio_file(title_audio):
+    original_duration = verify_audio_file(title_audio)
+    if original_duration is None:
         raise Exception("Missing or invalid title audio file")
-    
-    # Use title audio without speed modifications
-    title_clip = ffmpeg.input(title_audio)
-    audio_clips.append(title_clip)
-    
-    # Get the duration of the title audio file
-    probe = ffmpeg.probe(title_audio)
-    original_duration = float(probe["format"]["duration"])
-    audio_clips_durations = [original_duration]
+
+    audio_clips.append(title_audio)
 
     # Add all other audio clips without speed adjustment
     if settings.config["settings"]["storymode"]:
         if settings.config["settings"]["storymodemethod"] == 0:
             # Single post method
             audio_file = f"assets/temp/{reddit_id}/mp3/post.mp3"
-            if not verify_audio_file(audio_file):
+            original_duration = verify_audio_file(audio_file)
+            if original_duration is None:
                 raise Exception(f"Missing or invalid audio file: {audio_file}")
-            
-            audio_clip = ffmpeg.input(audio_file)
-            audio_clips.append(audio_clip)
-            
-            # Get the duration of the original audio file
-            probe = ffmpeg.probe(audio_file)
-            original_duration = float(probe["format"]["duration"])
-            audio_clips_durations.append(original_duration)
+
+            audio_clips.append(audio_file)
         elif settings.config["settings"]["storymodemethod"] == 1:
             # Multiple post method
             for i in range(number_of_clips):
                 audio_file = f"assets/temp/{reddit_id}/mp3/post-{i}.mp3"
-                if not verify_audio_file(audio_file):
+                original_duration = verify_audio_file(audio_file)
+                if original_duration is None:
                     raise Exception(f"Missing or invalid audio file: {audio_file}")
-                
-                audio_clip = ffmpeg.input(audio_file)
-                audio_clips.append(audio_clip)
-                
-                # Get the duration of the original audio file
-                probe = ffmpeg.probe(audio_file)
-                original_duration = float(probe["format"]["duration"])
-                audio_clips_durations.append(original_duration)
+
+                audio_clips.append(audio_file)
     else:
         # Comment mode
         for i in range(0, number_of_clips):
             audio_file = f"assets/temp/{reddit_id}/mp3/{i}.mp3"
-            if not verify_audio_file(audio_file):
+            original_duration = verify_audio_file(audio_file)
+            if original_duration is None:
                 raise Exception(f"Missing or invalid audio file: {audio_file}")
-            
-            audio_clip = ffmpeg.input(audio_file)
-            audio_clips.append(audio_clip)
-            
-            # Get the duration of the original audio file
-            probe = ffmpeg.probe(audio_file)
-            original_duration = float(probe["format"]["duration"])
-            audio_clips_durations.append(original_duration)
+
+            audio_clips.append(audio_file)
 
     # Add ending audio without speed adjustment
     ending_audio = f"assets/temp/{reddit_id}/mp3/ending.mp3"
-    if not verify_audio_file(ending_audio):
+    if verify_audio_file(ending_audio) is None:
         raise Exception("Missing or invalid ending audio file")
-    
-    ending_clip = ffmpeg.input(ending_audio)
-    audio_clips.append(ending_clip)
 
-    # Concatenate audio with error handling
+    audio_clips.append(ending_audio)
+
+    # Every clip is decoded once and joined/mixed as PCM, the only encode is the final mux
     try:
-        audio_concat = ffmpeg.concat(*audio_clips, a=1, v=0)
-        ffmpeg.output(
-            audio_concat, f"assets/temp/{reddit_id}/audio.mp3", **{"b:a": "192k"}
-        ).overwrite_output().run(quiet=True)
+        audio_clips_durations, final_audio_path = assemble_audio(
+            audio_clips,
+            f"assets/temp/{reddit_id}/audio.wav",
+            gap=float(settings.config["settings"]["tts"]["silence_duration"]),
+            background_path=f"assets/temp/{reddit_id}/background.mp3",
+            background_volume=background_audio_volume(),
+            mixed_path=f"assets/temp/{reddit_id}/audio_mixed.wav",
+        )
     except ffmpeg.Error as e:
-        print(f"Error concatenating audio: {e.stderr.decode('utf8')}")
-        raise Exception("Failed to concatenate audio files")
-
-    console.log(f"[bold green] Video Will Be: {length} Seconds Long")
+        print(f"Error assembling audio: {e.stderr.decode('utf8')}")
+        raise Exception("Failed to assemble audio files")
+    length = sum(audio_clips_durations)
 
-    screenshot_width = int((W * 65) // 100)
-    audio = ffmpeg.input(f"assets/temp/{reddit_id}/audio.mp3")
-    final_audio = merge_background_audio(audio, reddit_id)
+    console.log(f"[bold green] Video Will Be: {length:.2f} Seconds Long")
 
-    image_clips = list()
+    screenshot_width = overlay_width(W)
+    audio = ffmpeg.input(f"assets/temp/{reddit_id}/audio.wav")
+    final_audio = ffmpeg.input(final_audio_path)
 
     Path(f"assets/temp/{reddit_id}/png").mkdir(parents=True, exist_ok=True)
 
     # Credits to tim (beingbored)
     # get the title_template image and draw a text in the middle part of it with the title of the thread
-    title_template = Image.open("assets/title_template.png")
+    title_template = get_image("assets/title_template.png")
 
     title = reddit_obj["thread_title"]
 
@@ -390,89 +819,43 @@ def make_final_video(
     # create_fancy_thumbnail(image, text, text_color, padding
     title_img = create_fancy_thumbnail(title_template, title, font_color, padding)
 
-    title_img.save(f"assets/temp/{reddit_id}/png/title.png")
-    image_clips.insert(
-        0,
-        ffmpeg.input(f"assets/temp/{reddit_id}/png/title.png")["v"].filter(
-            "scale", screenshot_width, -1
-        ),
-    )
+    # stored at its on-screen width, like the screenshots
+    fit_overlay(title_img, screenshot_width).save(f"assets/temp/{reddit_id}/png/title.png")
 
-    current_time = 0
+    # (image, seconds on screen) for every segment, in playback order.
+    # The title is shown while the title audio plays
+    segments = [(f"assets/temp/{reddit_id}/png/title.png", audio_clips_durations[0])]
     if settings.config["settings"]["storymode"]:
         if settings.config["settings"]["storymodemethod"] == 0:
-            # Show title during silence
-            background_clip = background_clip.overlay(
-                image_clips[0],
-                enable=f"between(t,{current_time},{current_time + audio_clips_durations[0]})",
-                x="(main_w-overlay_w)/2",
-                y="(main_h-overlay_h)/2",
-            )
-            current_time += audio_clips_durations[0]
-
             # Show content with TTS
-            image_clips.insert(
-                1,
-                ffmpeg.input(f"assets/temp/{reddit_id}/png/story_content.png").filter(
-                    "scale", screenshot_width, -1
-                ),
-            )
-            background_clip = background_clip.overlay(
-                image_clips[1],
-                enable=f"between(t,{current_time},{current_time + audio_clips_durations[1]})",
-                x="(main_w-overlay_w)/2",
-                y="(main_h-overlay_h)/2",
+            segments.append(
+                (
+                    f"assets/temp/{reddit_id}/png/story_content.png",
+                    audio_clips_durations[1],
+                )
             )
-            current_time += audio_clips_durations[1]
         elif settings.config["settings"]["storymodemethod"] == 1:
-            # Show title during silence
-            background_clip = background_clip.overlay(
-                image_clips[0],
-                enable=f"between(t,{current_time},{current_time + audio_clips_durations[0]})",
-                x="(main_w-overlay_w)/2",
-                y="(main_h-overlay_h)/2",
-            )
-            current_time += audio_clips_durations[0]
-
             # Show content slides with TTS
-            for i in track(range(0, number_of_clips), "Collecting the image files..."):
-                image_clips.append(
-                    ffmpeg.input(f"assets/temp/{reddit_id}/png/img{i}.png")["v"].filter(
-                        "scale", screenshot_width, -1
-                    )
+            for i in range(0, number_of_clips):
+                segments.append(
+                    (f"assets/temp/{reddit_id}/png/img{i}.png", audio_clips_durations[i + 1])
                 )
-                background_clip = background_clip.overlay(
-                    image_clips[i + 1],
-                    enable=f"between(t,{current_time},{current_time + audio_clips_durations[i + 1]})",
-                    x="(main_w-overlay_w)/2",
-                    y="(main_h-overlay_h)/2",
-                )
-                current_time += audio_clips_durations[i + 1]
     else:
-        # Show title during silence
-        background_clip = background_clip.overlay(
-            image_clips[0],
-            enable=f"between(t,{current_time},{current_time + audio_clips_durations[0]})",
-            x="(main_w-overlay_w)/2",
-            y="(main_h-overlay_h)/2",
-        )
-        current_time += audio_clips_durations[0]
-
         # Show comments with TTS
         for i in range(0, number_of_clips):
-            image_clips.append(
-                ffmpeg.input(f"assets/temp/{reddit_id}/png/comment_{i}.png")["v"].filter(
-                    "scale", screenshot_width, -1
-                )
+            segments.append(
+                (f"assets/temp/{reddit_id}/png/comment_{i}.png", audio_clips_durations[i + 1])
             )
-            image_overlay = image_clips[i + 1].filter("colorchannelmixer", aa=opacity)
-            background_clip = background_clip.overlay(
-                image_overlay,
-                enable=f"between(t,{current_time},{current_time + audio_clips_durations[i + 1]})",
-                x="(main_w-overlay_w)/2",
-                y="(main_h-overlay_h)/2",
-            )
-            current_time += audio_clips_durations[i + 1]
+
+    # All segments go through a single overlay, however many comments there are
+    image_timeline = ffmpeg.input(
+        build_image_timeline(reddit_id, segments), f="concat", safe=0
+    )
+    background_clip = background_clip.overlay(
+        image_timeline["v"],
+        x="(main_w-overlay_w)/2",
+        y="(main_h-overlay_h)/2",
+    )
 
     title = re.sub(r"[^\w\s-]", "", reddit_obj["thread_title"])
     idx = re.sub(r"[^\w\s-]", "", reddit_obj["thread_id"])
@@ -499,7 +882,7 @@ def make_final_video(
             font_family = settingsbackground["background_thumbnail_font_family"]
             font_size = settingsbackground["background_thumbnail_font_size"]
             font_color = settingsbackground["background_thumbnail_font_color"]
-            thumbnail = Image.open(f"assets/backgrounds/{first_image}")
+            thumbnail = get_image(f"assets/backgrounds/{first_image}")
             width, height = thumbnail.size
             thumbnailSave = create_thumbnail(
                 thumbnail,
@@ -513,42 +896,66 @@ def make_final_video(
             thumbnailSave.save(f"./assets/temp/{reddit_id}/thumbnail.png")
             print_substep(f"Thumbnail - Building Thumbnail in assets/temp/{reddit_id}/thumbnail.png")
 
-    text = f"Background by {background_config['video'][2]}"
-    background_clip = ffmpeg.drawtext(
-        background_clip,
-        text=text,
-        x=f"(w-text_w)",
-        y=f"(h-text_h)",
-        fontsize=5,
-        fontcolor="White",
-        fontfile=os.path.join("fonts", "Roboto-Regular.ttf"),
-    )
+    print_step("Planning the render 📝" if dry_run else "Rendering the video 🎥")
+    started = time.monotonic()
+    rescale = not single_pass or profile["scale"] != 1
+    if parallel_workers > 1:
+        # The segments are encoded as separate chunks, so the final mux only copies the video
+        background_clip = render_segments_parallel(
+            reddit_id,
+            segments,
+            length,
+            W,
+            H,
+            profile,
+            single_pass,
+            background_config["video"][2],
+            parallel_workers,
+            planned,
+        )
+        video_args = {"c:v": "copy"}
+    else:
+        background_clip = decorate_video(
+            background_clip, background_config["video"][2], W, H, profile, rescale
+        )
+        video_args = video_encode_args(profile)
+    defaultPath = subreddit_path
+    path = defaultPath + f"/{filename}"
+    path = path[:251] + ".mp4"  # Prevent a error by limiting the path length, do not change this.
+    encode_args = {
+        **video_args,
+        "c:a": "aac",
+        "b:a": "192k",
+    }
+    if allowOnlyTTSFolder:
+        only_tts_video = f"{subreddit_path}/OnlyTTS/{filename}"
+        only_tts_video = only_tts_video[:251] + ".mp4"
+        print_substep("Rendering the Only TTS Video alongside the main video 🎥")
+        # The video stream is encoded once and the tee muxer writes it into both files,
+        # each paired with its own audio track (a:0 is the mixed audio, a:1 the raw TTS)
+        output = ffmpeg.output(
+            background_clip,
+            final_audio,
+            audio,
+            "|".join(
+                [
+                    tee_output(path, "v:0,a:0"),
+                    tee_output(only_tts_video, "v:0,a:1"),
+                ]
+            ),
+            f="tee",
+            flags="+global_header",
+            **encode_args,
+        )
+    else:
+        output = ffmpeg.output(background_clip, final_audio, path, f="mp4", **encode_args)
 
-    # Add progress bar
-    # First draw the background bar
-    background_clip = ffmpeg.drawbox(
-        background_clip,
-        x="0",
-        y="(h-10)",  # 10 pixels from bottom
-        width="iw",  # Use input width
-        height="5",  # 5 pixels height
-        color="black@0.5",  # Semi-transparent black
-        t="fill"
-    )
-    
-    # Then draw the progress bar that fills up
-    background_clip = ffmpeg.drawbox(
-        background_clip,
-        x="0",
-        y="(h-10)",  # 10 pixels from bottom
-        width="(iw*t/67)",  # Dynamic width based on current time (67 seconds total)
-        height="5",  # 5 pixels height
-        color="white@0.8",  # Semi-transparent white
-        t="fill"
-    )
+    if dry_run:
+        planned.append(output.overwrite_output())
+        plan_path = path[:-4] + ".plan.json"
+        export_render_plan(plan_path, planned, length, profile_name, parallel_workers, path)
+        return plan_path
 
-    background_clip = background_clip.filter("scale", W, H)
-    print_step("Rendering the video 🎥")
     from tqdm import tqdm
 
     pbar = tqdm(total=100, desc="Progress: ", bar_format="{l_bar}{bar}", unit=" %")
@@ -558,68 +965,27 @@ def make_final_video(
         old_percentage = pbar.n
         pbar.update(status - old_percentage)
 
-    defaultPath = subreddit_path
-    with ProgressFfmpeg(length, on_update_example) as progress:
-        path = defaultPath + f"/{filename}"
-        path = (
-            path[:251] + ".mp4"
-        )  # Prevent a error by limiting the path length, do not change this.
-        try:
-            ffmpeg.output(
-                background_clip,
-                final_audio,
-                path,
-                f="mp4",
-                **{
-                    "c:v": "h264",
-                    "b:v": "20M",
-                    "b:a": "192k",
-                    "threads": multiprocessing.cpu_count(),
-                },
-            ).overwrite_output().global_args("-progress", progress.output_file.name).run(
-                quiet=True,
-                overwrite_output=True,
-                capture_stdout=False,
-                capture_stderr=False,
-            )
-        except ffmpeg.Error as e:
-            print(e.stderr.decode("utf8"))
-            exit(1)
+    try:
+        stats = run_ffmpeg(output, length, on_update_example)
+    except ffmpeg.Error as e:
+        print(e.stderr.decode("utf8"))
+        exit(1)
     old_percentage = pbar.n
     pbar.update(100 - old_percentage)
-    if allowOnlyTTSFolder:
-        path = f"{subreddit_path}/OnlyTTS/{filename}"
-        path = (
-            path[:251] + ".mp4"
-        )  # Prevent a error by limiting the path length, do not change this.
-        print_step("Rendering the Only TTS Video 🎥")
-        with ProgressFfmpeg(length, on_update_example) as progress:
-            try:
-                ffmpeg.output(
-                    background_clip,
-                    audio,
-                    path,
-                    f="mp4",
-                    **{
-                        "c:v": "h264",
-                        "b:v": "20M",
-                        "b:a": "192k",
-                        "threads": multiprocessing.cpu_count(),
-                    },
-                ).overwrite_output().global_args("-progress", progress.output_file.name).run(
-                    quiet=True,
-                    overwrite_output=True,
-                    capture_stdout=False,
-                    capture_stderr=False,
-                )
-            except ffmpeg.Error as e:
-                print(e.stderr.decode("utf8"))
-                exit(1)
-
-        old_percentage = pbar.n
-        pbar.update(100 - old_percentage)
     pbar.close()
-    save_data(subreddit, filename + ".mp4", title, idx, background_config["video"][2])
+    if stats is not None and stats.frame and stats.speed:
+        print_substep(f"Encoded {stats.frame} frames at {stats.fps:g} fps ({stats.speed:g}x realtime)")
+    render_seconds += time.monotonic() - started
+    record_render(
+        profile_name,
+        parallel_workers if parallel_workers > 1 else 0,
+        length,
+        render_seconds,
+        stats.frame if stats is not None else 0,
+    )
+    save_data(
+        subreddit, filename + ".mp4", title, idx, background_config["video"][2], profile_name
+    )
     print_step("Removing temporary files 🗑")
     cleanups = cleanup(reddit_id)
     print_substep(f"Removed {cleanups} temporary files 🗑")
@@ -9,7 +9,7 @@ from rich.progress import track
 
 from utils import settings
 from utils.console import print_step, print_substep
-from utils.imagenarator import imagemaker
+from utils.imagenarator import imagemaker, overlay_width, prepare_overlay
 from utils.playwright import clear_cookie_by_name
 from utils.videos import save_data
 
@@ -28,6 +28,9 @@ def get_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: int):
     H: Final[int] = int(settings.config["settings"]["resolution_h"])
     lang: Final[str] = settings.config["reddit"]["thread"]["post_lang"]
     storymode: Final[bool] = settings.config["settings"]["storymode"]
+    opacity: Final[float] = settings.config["settings"]["opacity"]
+    # Screenshots are stored at the size and opacity they are shown at in the video
+    screenshot_width: Final[int] = overlay_width(W)
 
     print_step("Downloading screenshots of reddit posts...")
     reddit_id = re.sub(r"[^\w\s-]", "", reddit_object["thread_id"])
@@ -67,6 +70,7 @@ def get_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: int):
             reddit_obj=reddit_object,
             txtclr=txtcolor,
             transparent=transparent,
+            width=screenshot_width,
         )
 
     screenshot_num: int
@@ -206,6 +210,7 @@ def get_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: int):
             page.locator('[data-click-id="text"]').first.screenshot(
                 path=f"assets/temp/{reddit_id}/png/story_content.png"
             )
+            prepare_overlay(f"assets/temp/{reddit_id}/png/story_content.png", screenshot_width)
         else:
             for idx, comment in enumerate(
                 track(
@@ -254,6 +259,9 @@ def get_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: int):
                         page.locator(f"#t1_{comment['comment_id']}").screenshot(
                             path=f"assets/temp/{reddit_id}/png/comment_{idx}.png"
                         )
+                    prepare_overlay(
+                        f"assets/temp/{reddit_id}/png/comment_{idx}.png", screenshot_width, opacity
+                    )
                 except TimeoutError:
                     del reddit_object["comments"]
                     screenshot_num += 1
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import Tuple
 
 from rich.console import Console
@@ -6,6 +7,7 @@ from TTS.aws_polly import AWSPolly
 from TTS.elevenlabs import elevenlabs
 from TTS.engine_wrapper import TTSEngine
 from TTS.GTTS import GTTS
+from TTS.hedged import HedgedTTS
 from TTS.pyttsx import pyttsx
 from TTS.streamlabs_polly import StreamlabsPolly
 from TTS.TikTok import TikTok
@@ -35,20 +37,50 @@ def save_text_to_mp3(reddit_obj) -> Tuple[int, int]:
     """
 
     voice = settings.config["settings"]["tts"]["voice_choice"]
-    if str(voice).casefold() in map(lambda _: _.casefold(), TTSProviders):
-        text_to_mp3 = TTSEngine(get_case_insensitive_key_value(TTSProviders, voice), reddit_obj)
-    else:
+    # comments that would make the video longer than this are dropped before any TTS call
+    max_length = float(settings.get_setting("settings", "tts", "max_video_length"))
+    if str(voice).casefold() not in map(lambda _: _.casefold(), TTSProviders):
         while True:
             print_step("Please choose one of the following TTS providers: ")
             print_table(TTSProviders)
-            choice = input("\n")
-            if choice.casefold() in map(lambda _: _.casefold(), TTSProviders):
+            voice = input("\n")
+            if voice.casefold() in map(lambda _: _.casefold(), TTSProviders):
                 break
             print("Unknown Choice")
-        text_to_mp3 = TTSEngine(get_case_insensitive_key_value(TTSProviders, choice), reddit_obj)
+    text_to_mp3 = TTSEngine(provider_chain(voice), reddit_obj, max_length=max_length)
     return text_to_mp3.run()
 
 
+def provider_chain(voice: str):
+    """Returns the provider to pass to TTSEngine: the chosen one, or a hedged chain of it and the
+    fallback providers
+
+    Args:
+        voice (str): The chosen provider
+
+    Returns:
+        The provider class, or a factory of a HedgedTTS
+    """
+    chain = [get_case_insensitive_key_value(TTSProviders, voice)]
+    fallbacks = settings.get_setting("settings", "tts", "fallback_providers")
+    if not isinstance(fallbacks, str):  # unset in a config checked before the setting existed
+        fallbacks = ""
+    for name in fallbacks.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        provider = get_case_insensitive_key_value(TTSProviders, name)
+        if provider is None:
+            raise ValueError(
+                f"Unknown fallback TTS provider {name}. options are: {list(TTSProviders)}"
+            )
+        if provider not in chain:
+            chain.append(provider)
+    if len(chain) == 1:
+        return chain[0]
+    return partial(HedgedTTS, chain)
+
+
 def get_case_insensitive_key_value(input_dict, key):
     return next(
         (value for dict_key, value in input_dict.items() if dict_key.lower() == key.lower()),